@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+
+# Run one command line script in this fresh interpreter and
+# write its wall time and peak RSS in json format. Benchmarks
+# start this runner for each case so that the measurement does
+# not include the memory of the benchmark process.
+#
+# Usage: benchmark_case_runner.py <result json> <script> [script arguments]
+
+import resource
+import runpy
+import time
+import json
+import sys
+import os
+
+def get_peak_rss_mb():
+    '''
+    Return the peak resident set size in MB of this process, or
+    of its largest worker process if that is larger.
+
+    VmHWM starts over when the interpreter is exec'd, while
+    ru_maxrss of RUSAGE_SELF keeps the peak of the process
+    that forked it. ru_maxrss is only used if /proc is not available.
+    '''
+    peak_rss_kb = None
+    if os.path.exists("/proc/self/status"):
+        with open("/proc/self/status", "r") as status_f:
+            for line in status_f:
+                if line.startswith("VmHWM:"):
+                    peak_rss_kb = int(line.split()[1])
+
+    if peak_rss_kb is None:
+        peak_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    return max(peak_rss_kb, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) / 1024
+
+if __name__ == "__main__":
+    result_path = sys.argv[1]
+    script_path = os.path.abspath(sys.argv[2])
+
+    # The script sees its own arguments and imports its neighbours
+    sys.argv = sys.argv[2:]
+    sys.path.insert(0, os.path.dirname(script_path))
+
+    start_time = time.perf_counter()
+    runpy.run_path(script_path, run_name="__main__")
+    wall_time = time.perf_counter() - start_time
+
+    with open(result_path, "w") as result_f:
+        json.dump({"wall_time_s": wall_time,
+                   "peak_rss_mb": get_peak_rss_mb(),
+                   }, result_f)
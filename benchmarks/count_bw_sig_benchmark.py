@@ -0,0 +1,278 @@
+#!/usr/bin/env python
+
+# Throughput benchmark for the bigwig counting hot path
+# (count_bw_sig.py and genomicelement_tool.py count_bw)
+# on synthetic stranded bigwigs.
+
+import subprocess
+import argparse
+import shutil
+import json
+import sys
+import os
+
+import numpy as np
+import pandas as pd
+import pyBigWig
+
+class CountBwSigBenchmark:
+    @staticmethod
+    def set_parser(parser):
+        parser.add_argument("--n_regions",
+                            help="Number of regions. Can be given multiple times. [10000]",
+                            action="append",
+                            type=int,
+                            dest="n_regions_list",
+                            )
+
+        parser.add_argument("--n_samples",
+                            help="Number of samples (bigwig pairs). Can be given multiple times. [1]",
+                            action="append",
+                            type=int,
+                            dest="n_samples_list",
+                            )
+
+        parser.add_argument("--region_size",
+                            help="Size of each region. [1000]",
+                            type=int,
+                            default=1000,
+                            dest="region_size",
+                            )
+
+        parser.add_argument("--n_chroms",
+                            help="Number of chromosomes of the synthetic genome. [4]",
+                            type=int,
+                            default=4,
+                            dest="n_chroms",
+                            )
+
+        parser.add_argument("--chrom_size",
+                            help="Size of each chromosome of the synthetic genome. [10000000]",
+                            type=int,
+                            default=10000000,
+                            dest="chrom_size",
+                            )
+
+        parser.add_argument("--signal_density",
+                            help="Fraction of bases with signal in the synthetic bigwigs. [0.01]",
+                            type=float,
+                            default=0.01,
+                            dest="signal_density",
+                            )
+
+        parser.add_argument("--output_type",
+                            help="Output type passed to count_bw_sig.py. genomicelement_tool.py count_bw "
+                                 "is run once per type of a comma separated list. [raw_count]",
+                            type=str,
+                            default="raw_count",
+                            dest="output_type",
+                            )
+
+        parser.add_argument("--processes",
+                            help="Number of processes passed to both scripts. [1]",
+                            type=int,
+                            default=1,
+                            dest="processes",
+                            )
+
+        parser.add_argument("--approximate",
+                            help="Count from the zoom levels in both scripts (see --approximate of count_bw_sig.py). [False]",
+                            action="store_true",
+                            dest="approximate",
+                            )
+
+        parser.add_argument("--work_dir",
+                            help="Directory for synthetic data and outputs (removed afterwards). "
+                                 "[count_bw_sig_benchmark_temp]",
+                            type=str,
+                            default="count_bw_sig_benchmark_temp",
+                            dest="work_dir",
+                            )
+
+        parser.add_argument("--seed",
+                            help="Random seed. [0]",
+                            type=int,
+                            default=0,
+                            dest="seed",
+                            )
+
+        parser.add_argument("--opath",
+                            help="Output path of the benchmark results in json format. [stdout]",
+                            type=str,
+                            default="stdout",
+                            dest="opath",
+                            )
+
+    @staticmethod
+    def get_chrom_sizes(n_chroms, chrom_size):
+        '''
+        Return the list of (chrom, size) of the synthetic genome.
+        '''
+        return [("chr{}".format(i + 1), chrom_size) for i in range(n_chroms)]
+
+    @staticmethod
+    def write_synthetic_bw(opath, chrom_sizes, signal_density, sign, rng):
+        '''
+        Write a synthetic single base resolution bigwig.
+
+        Keyword arguments:
+        - opath: output path
+        - chrom_sizes: list of (chrom, size)
+        - signal_density: fraction of bases with signal
+        - sign: 1 for plus strand and -1 for minus strand
+        - rng: np.random.Generator
+        '''
+        bw = pyBigWig.open(opath, "w")
+        bw.addHeader(chrom_sizes)
+
+        for chrom, chrom_size in chrom_sizes:
+            n_sites = int(chrom_size * signal_density)
+            sites = np.sort(rng.choice(chrom_size, n_sites, replace=False))
+            values = rng.integers(1, 20, n_sites).astype(np.float64) * sign
+
+            bw.addEntries([chrom] * n_sites,
+                          sites.tolist(),
+                          ends=(sites + 1).tolist(),
+                          values=values.tolist(),
+                          )
+
+        bw.close()
+
+    @staticmethod
+    def write_synthetic_regions(opath, chrom_sizes, n_regions, region_size, rng):
+        '''
+        Write a synthetic bed6 file of regions in random order.
+        '''
+        chrom_inds = rng.integers(0, len(chrom_sizes), n_regions)
+        starts = rng.integers(0, chrom_sizes[0][1] - region_size, n_regions)
+
+        region_df = pd.DataFrame({"chrom": np.array([c for c, _ in chrom_sizes])[chrom_inds],
+                                  "start": starts,
+                                  "end": starts + region_size,
+                                  "name": ["region{}".format(i) for i in range(n_regions)],
+                                  "score": 0,
+                                  "strand": rng.choice(["+", "-"], n_regions),
+                                  })
+
+        region_df.to_csv(opath, sep="\t", header=False, index=False)
+
+    @staticmethod
+    def get_scripts_dir():
+        return os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts")
+
+    @staticmethod
+    def run_case(case_cmd, work_dir):
+        '''
+        Run one benchmark case, a command line script with its 
+        arguments, in a fresh interpreter (see benchmark_case_runner.py) 
+        so that the peak RSS belongs to the case only. 
+
+        Returns:
+        - wall_time_s, peak_rss_mb
+        '''
+        result_path = os.path.join(work_dir, "case_result.json")
+        subprocess.run([sys.executable, 
+                        os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_case_runner.py"), 
+                        result_path, 
+                        ] + case_cmd, 
+                       check=True, 
+                       )
+
+        with open(result_path, "r") as result_f:
+            result_dict = json.load(result_f)
+
+        return result_dict["wall_time_s"], result_dict["peak_rss_mb"]
+
+    @staticmethod
+    def get_count_bw_sig_cmd(bw_pls, bw_mns, region_path, args):
+        case_cmd = [os.path.join(CountBwSigBenchmark.get_scripts_dir(), "count_bw_sig.py"), 
+                    "--region_file_path", region_path, 
+                    "--region_file_type", "bed6", 
+                    "--job_name", "benchmark", 
+                    "--opath", os.path.join(args.work_dir, "output"), 
+                    "--min_len_after_padding", "1", 
+                    "--output_type", args.output_type, 
+                    "--region_id_type", "chrom_start_end_name", 
+                    "--processes", str(args.processes), 
+                    "--approximate", str(args.approximate), 
+                    ]
+        for i, (bw_pl, bw_mn) in enumerate(zip(bw_pls, bw_mns)):
+            case_cmd += ["--sample", "sample{}".format(i), "--bw_pl", bw_pl, "--bw_mn", bw_mn]
+
+        return case_cmd
+
+    @staticmethod
+    def get_genomicelement_tool_count_bw_cmd(bw_pl, bw_mn, region_path, quantification_type, args):
+        return [os.path.join(CountBwSigBenchmark.get_scripts_dir(), "genomicelement_tool.py"), 
+                "count_bw", 
+                "--region_file_path", region_path, 
+                "--region_file_type", "bed6", 
+                "--bw_pl", bw_pl, 
+                "--bw_mn", bw_mn, 
+                "--quantification_type", quantification_type, 
+                "--opath", os.path.join(args.work_dir, "output", "count_bw.npy"), 
+                "--processes", str(args.processes), 
+                "--approximate", str(args.approximate), 
+                ]
+
+    @staticmethod
+    def main(args):
+        n_regions_list = args.n_regions_list if args.n_regions_list else [10000]
+        n_samples_list = args.n_samples_list if args.n_samples_list else [1]
+
+        rng = np.random.default_rng(args.seed)
+        chrom_sizes = CountBwSigBenchmark.get_chrom_sizes(args.n_chroms, args.chrom_size)
+
+        os.makedirs(os.path.join(args.work_dir, "output"), exist_ok=True)
+
+        bw_pls = []
+        bw_mns = []
+        for i in range(max(n_samples_list)):
+            bw_pls.append(os.path.join(args.work_dir, "sample{}.pl.bw".format(i)))
+            bw_mns.append(os.path.join(args.work_dir, "sample{}.mn.bw".format(i)))
+            CountBwSigBenchmark.write_synthetic_bw(bw_pls[-1], chrom_sizes, args.signal_density, 1, rng)
+            CountBwSigBenchmark.write_synthetic_bw(bw_mns[-1], chrom_sizes, args.signal_density, -1, rng)
+
+        result_list = []
+        try:
+            for n_regions in n_regions_list:
+                region_path = os.path.join(args.work_dir, "regions.{}.bed6".format(n_regions))
+                CountBwSigBenchmark.write_synthetic_regions(region_path, chrom_sizes, n_regions, args.region_size, rng)
+
+                # count_bw takes a single quantification type
+                case_list = [("genomicelement_tool_count_bw", 1, output_type,
+                              CountBwSigBenchmark.get_genomicelement_tool_count_bw_cmd(bw_pls[0], bw_mns[0], region_path, output_type, args))
+                             for output_type in args.output_type.split(",")]
+                for n_samples in n_samples_list:
+                    case_list.append(("count_bw_sig", n_samples, args.output_type,
+                                      CountBwSigBenchmark.get_count_bw_sig_cmd(bw_pls[:n_samples], bw_mns[:n_samples], region_path, args)))
+
+                for case_name, n_samples, output_type, case_cmd in case_list:
+                    wall_time, peak_rss_mb = CountBwSigBenchmark.run_case(case_cmd, args.work_dir)
+
+                    result_list.append({"case": case_name,
+                                        "n_regions": n_regions,
+                                        "n_samples": n_samples,
+                                        "region_size": args.region_size,
+                                        "output_type": output_type,
+                                        "processes": args.processes,
+                                        "approximate": args.approximate,
+                                        "wall_time_s": wall_time,
+                                        "regions_per_s": n_regions * n_samples / wall_time,
+                                        "peak_rss_mb": peak_rss_mb,
+                                        })
+        finally:
+            shutil.rmtree(args.work_dir, ignore_errors=True)
+
+        if args.opath == "stdout":
+            json.dump(result_list, sys.stdout, indent=4)
+            sys.stdout.write("\n")
+        else:
+            with open(args.opath, "w") as output_f:
+                json.dump(result_list, output_f, indent=4)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark bigwig counting on synthetic data.")
+    CountBwSigBenchmark.set_parser(parser)
+    args = parser.parse_args()
+    CountBwSigBenchmark.main(args)
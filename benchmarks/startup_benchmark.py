@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+
+# Cold start benchmark of the command line scripts.
+# Each case runs `<script> [subcommand] --help` in a fresh
+# interpreter, which measures imports and parser construction
+# only, and records the heavy dependencies that got imported.
+
+import subprocess
+import argparse
+import time
+import json
+import sys
+import os
+
+class StartupBenchmark:
+    @staticmethod
+    def set_parser(parser):
+        parser.add_argument("--n_repeats",
+                            help="Number of runs of each case. The fastest run is reported. [5]",
+                            type=int,
+                            default=5,
+                            dest="n_repeats",
+                            )
+
+        parser.add_argument("--baseline",
+                            help="Benchmark results in json format of a previous run. "
+                                 "The benchmark fails if a case is slower than its baseline "
+                                 "by more than the tolerance. [None]",
+                            type=str,
+                            default=None,
+                            dest="baseline",
+                            )
+
+        parser.add_argument("--tolerance",
+                            help="Allowed relative slowdown against the baseline. [0.2]",
+                            type=float,
+                            default=0.2,
+                            dest="tolerance",
+                            )
+
+        parser.add_argument("--max_wall_time",
+                            help="The benchmark fails if a case takes longer than this (seconds). [None]",
+                            type=float,
+                            default=None,
+                            dest="max_wall_time",
+                            )
+
+        parser.add_argument("--opath",
+                            help="Output path of the benchmark results in json format. [stdout]",
+                            type=str,
+                            default="stdout",
+                            dest="opath",
+                            )
+
+    @staticmethod
+    def get_cases():
+        '''
+        Return the list of (script, subcommand) to benchmark.
+        subcommand is None for scripts without subcommands.
+        '''
+        return [("count_bw_sig.py", None),
+                ("count_table_tool.py", "per_million_normalization"),
+                ("count_table_tool.py", "cat_table"),
+                ("count_table_tool.py", "substitute_gene_id"),
+                ("count_table_tool.py", "divide_table"),
+                ("count_table_tool.py", "compute_tissue_tstat"),
+                ("count_table_tool.py", "tstat_table2bed"),
+                ("exogeneous_tool.py", "metaplot"),
+                ("exogeneous_tool.py", "filter"),
+                ("exogeneous_tool.py", "compare_mutagenesis"),
+                ("exogeneous_tool.py", "compute_track_correlation"),
+                ("genomicelement_tool.py", "count_bw"),
+                ("genomicelement_tool.py", "pad_region"),
+                ("genomicelement_tool.py", "bed2tssbed"),
+                ("genomicelement_tool.py", "onehot"),
+                ("genomicelement_tool.py", "profile"),
+                ("genomicelement_tool.py", "extract_track"),
+                ("summarize_RSEM.py", None),
+                ]
+
+    @staticmethod
+    def get_heavy_modules():
+        '''
+        Return the top level modules that should only be
+        imported by the subcommands that use them.
+        '''
+        return ["matplotlib", "scipy", "sklearn", "umap", "statsmodels", "Bio"]
+
+    @staticmethod
+    def get_case_name(script, subcommand):
+        if subcommand is None:
+            return script
+        return "{} {}".format(script, subcommand)
+
+    @staticmethod
+    def run_case(script_path, subcommand):
+        '''
+        Run one case in a fresh interpreter.
+
+        Returns:
+        - wall time in seconds
+        - list of heavy modules imported
+        '''
+        script_argv = [script_path] + ([subcommand] if subcommand else []) + ["--help"]
+
+        driver = "\n".join(["import runpy, json, sys, io, contextlib",
+                            "sys.argv = {}".format(repr(script_argv)),
+                            "sys.path.insert(0, {})".format(repr(os.path.dirname(script_path))),
+                            "with contextlib.redirect_stdout(io.StringIO()):",
+                            "    try:",
+                            "        runpy.run_path(sys.argv[0], run_name='__main__')",
+                            "    except SystemExit:",
+                            "        pass",
+                            "heavy_modules = {}".format(repr(StartupBenchmark.get_heavy_modules())),
+                            "print(json.dumps(sorted(m for m in heavy_modules if m in sys.modules)))",
+                            ])
+
+        start_time = time.perf_counter()
+        result = subprocess.run([sys.executable, "-c", driver],
+                                capture_output=True,
+                                text=True,
+                                )
+        wall_time = time.perf_counter() - start_time
+
+        if result.returncode != 0:
+            raise Exception("Failed to start {}:\n{}".format(" ".join(script_argv), result.stderr))
+
+        return wall_time, json.loads(result.stdout.strip().splitlines()[-1])
+
+    @staticmethod
+    def main(args):
+        script_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts")
+
+        baseline_dict = {}
+        if args.baseline:
+            with open(args.baseline, "r") as baseline_f:
+                baseline_dict = {r["case"]: r for r in json.load(baseline_f)}
+
+        result_list = []
+        failure_list = []
+        for script, subcommand in StartupBenchmark.get_cases():
+            case_name = StartupBenchmark.get_case_name(script, subcommand)
+
+            wall_time_list = []
+            for _ in range(args.n_repeats):
+                wall_time, heavy_modules = StartupBenchmark.run_case(os.path.join(script_dir, script), subcommand)
+                wall_time_list.append(wall_time)
+
+            result_list.append({"case": case_name,
+                                "wall_time_s": min(wall_time_list),
+                                "heavy_modules": heavy_modules,
+                                })
+
+            if heavy_modules:
+                failure_list.append("{} imports {} at startup".format(case_name, ", ".join(heavy_modules)))
+
+            if args.max_wall_time is not None and min(wall_time_list) > args.max_wall_time:
+                failure_list.append("{} takes {:.3f}s (limit {:.3f}s)".format(case_name,
+                                                                             min(wall_time_list),
+                                                                             args.max_wall_time,
+                                                                             ))
+
+            if case_name in baseline_dict:
+                baseline_wall_time = baseline_dict[case_name]["wall_time_s"]
+                if min(wall_time_list) > baseline_wall_time * (1 + args.tolerance):
+                    failure_list.append("{} takes {:.3f}s (baseline {:.3f}s)".format(case_name,
+                                                                                    min(wall_time_list),
+                                                                                    baseline_wall_time,
+                                                                                    ))
+
+        if args.opath == "stdout":
+            json.dump(result_list, sys.stdout, indent=4)
+            sys.stdout.write("\n")
+        else:
+            with open(args.opath, "w") as output_f:
+                json.dump(result_list, output_f, indent=4)
+
+        if failure_list:
+            sys.stderr.write("Startup regression:\n")
+            for failure in failure_list:
+                sys.stderr.write("- {}\n".format(failure))
+            sys.exit(1)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the cold start of the command line scripts.")
+    StartupBenchmark.set_parser(parser)
+    args = parser.parse_args()
+    StartupBenchmark.main(args)
@@ -4,7 +4,6 @@ import argparse
 import sys
 import re
 
-import pandas as pd
 import numpy as np
 
 from RGTools.BedTable import BedTable6, BedTable6Plus
@@ -72,16 +71,14 @@ class Bed2TSSBED:
         if not args.output_site in Bed2TSSBED.get_output_site_types():
             raise Exception("Unrecognized output site type: {}".format(args.output_site))
 
-    def get_site_coord(region, output_site_type):
+    @staticmethod
+    def get_site_coords(starts, ends, strands, output_site_type):
         if output_site_type == "TSS":
-            if region["strand"] == "+":
-                site = region["start"]
-            elif region["strand"] == "-":
-                site = region["end"] - 1
+            sites = np.where(strands == "+", starts, ends - 1)
         elif output_site_type == "center":
-            site = int((region["start"] + region["end"]) // 2)
+            sites = (starts + ends) // 2
         
-        return site
+        return sites
 
     @staticmethod
     def main(args):
@@ -90,18 +87,15 @@ class Bed2TSSBED:
         input_bed_table = Bed2TSSBED.read_input(args.bed_in, args.region_file_type)
         
         output_bt = input_bed_table._clone_empty()
-        output_region_list = []
-
-        for region in input_bed_table.iter_regions():
-            output_coord = Bed2TSSBED.get_site_coord(region, args.output_site)
-            
-            output_region_dict = region.to_dict()
-            output_region_dict["start"] = output_coord
-            output_region_dict["end"] = output_coord + 1
-            output_region_list.append(output_region_dict)
-
-        output_df = pd.DataFrame(output_region_list, 
-                                 columns=output_bt.column_names)
+        output_df = input_bed_table.to_dataframe()
+
+        output_coords = Bed2TSSBED.get_site_coords(output_df["start"].values, 
+                                                   output_df["end"].values, 
+                                                   np.array(output_df["strand"].values, dtype=str), 
+                                                   args.output_site, 
+                                                   )
+        output_df["start"] = output_coords
+        output_df["end"] = output_coords + 1
 
         output_bt.load_from_dataframe(output_df)
         output_bt.write(args.bed_out)
@@ -0,0 +1,809 @@
+# Batch bigwig signal counting shared by count_bw_sig.py 
+# and genomicelement_tool.py: per-chromosome cumulative 
+# signal, the on-disk signal cache and approximate counting 
+# from the zoom levels.
+
+import os
+import sys
+import json
+import zlib
+import shutil
+import struct
+import hashlib
+import pyBigWig
+import numpy as np
+import pandas as pd
+
+from RGTools.BwTrack import BwTrack
+
+class BwSignalCounter:
+    @staticmethod
+    def get_batch_quantification_types():
+        '''
+        Return the quantification types that are computed by the 
+        batch counting engine. Other types are computed region by 
+        region with BwTrack.
+        '''
+        return ["raw_count", "RPK", "CPM", "RPKM"]
+
+    @staticmethod
+    def get_supported_output_types():
+        '''
+        Return the list of supported output types: the quantification 
+        types of BwTrack and the library-size normalized types (CPM and 
+        RPKM) of the batch counting engine.
+        '''
+        bw_track_types = BwTrack.get_supported_quantification_type()
+        return bw_track_types + [t for t in BwSignalCounter.get_batch_quantification_types() if not t in bw_track_types]
+
+    @staticmethod
+    def get_bw_library_size(bw_pl_path, bw_mn_path, single_bw):
+        '''
+        Return the library size (total absolute signal) of a sample 
+        from the summary in the bigwig headers, without reading the signal.
+        '''
+        bw_paths = [bw_pl_path] if single_bw else [bw_pl_path, bw_mn_path]
+
+        library_size = 0
+        for bw_path in bw_paths:
+            bw = pyBigWig.open(bw_path)
+            library_size += abs(bw.header()["sumData"])
+            bw.close()
+
+        return library_size
+
+    @staticmethod
+    def load_chrom_signal_cumsum(bw, chrom):
+        '''
+        Load all intervals of a chromosome from an opened bigwig 
+        and build the cumulative signal array over the intervals.
+
+        Keyword arguments:
+        - bw: opened pyBigWig file
+        - chrom: chromosome name
+
+        Returns:
+        - interval_starts: np.array of interval starts (sorted)
+        - interval_ends: np.array of interval ends
+        - interval_values: np.array of absolute interval values
+        - signal_cumsum: np.array of length n_intervals + 1, 
+                         signal_cumsum[i] is the total signal 
+                         before the i-th interval.
+        '''
+        intervals = None
+        if chrom in bw.chroms():
+            intervals = bw.intervals(chrom)
+
+        if not intervals:
+            intervals_arr = np.zeros((0, 3), dtype=np.float64)
+        else:
+            intervals_arr = np.array(intervals, dtype=np.float64)
+
+        interval_starts = intervals_arr[:, 0].astype(np.int64)
+        interval_ends = intervals_arr[:, 1].astype(np.int64)
+        interval_values = np.abs(intervals_arr[:, 2])
+
+        signal_cumsum = np.zeros(len(interval_starts) + 1, dtype=np.float64)
+        np.cumsum((interval_ends - interval_starts) * interval_values, 
+                  out=signal_cumsum[1:], 
+                  )
+
+        return interval_starts, interval_ends, interval_values, signal_cumsum
+
+    @staticmethod
+    def query_signal_cumsum(interval_starts, interval_ends, interval_values, 
+                            signal_cumsum, pos):
+        '''
+        Return the total signal in [0, pos) for each position in pos.
+
+        Keyword arguments:
+        - interval_starts, interval_ends, interval_values, signal_cumsum: 
+            output of load_chrom_signal_cumsum
+        - pos: np.array of positions
+        '''
+        pos = np.asarray(pos, dtype=np.int64)
+        if len(interval_starts) == 0:
+            return np.zeros(pos.shape, dtype=np.float64)
+
+        interval_inds = np.searchsorted(interval_starts, pos, side="right") - 1
+        has_interval = interval_inds >= 0
+        interval_inds = np.where(has_interval, interval_inds, 0)
+
+        partial_len = np.clip(pos - interval_starts[interval_inds], 
+                              0, 
+                              interval_ends[interval_inds] - interval_starts[interval_inds], 
+                              )
+        signal = signal_cumsum[interval_inds] + partial_len * interval_values[interval_inds]
+
+        return np.where(has_interval, signal, 0.)
+
+    @staticmethod
+    def pad_region_coords(starts, ends, l_pad, r_pad, min_len_after_padding, 
+                          method_resolving_invalid_padding):
+        '''
+        Pad regions and resolve invalid padding for all regions at once.
+
+        Keyword arguments:
+        - starts: np.array of region starts
+        - ends: np.array of region ends
+        - l_pad: padding for the left side of the region
+        - r_pad: padding for the right side of the region
+        - min_len_after_padding: minimum length of the region after padding
+        - method_resolving_invalid_padding: raise, fallback or drop
+
+        Returns:
+        - padded_starts: np.array of padded starts
+        - padded_ends: np.array of padded ends
+        - valid_logical: np.array of bool, False for dropped regions
+        '''
+        starts = np.asarray(starts, dtype=np.int64)
+        ends = np.asarray(ends, dtype=np.int64)
+
+        padded_starts = starts - l_pad
+        padded_ends = ends + r_pad
+
+        invalid_logical = (padded_ends - padded_starts < min_len_after_padding) | (padded_starts < 0)
+        valid_logical = np.ones(len(starts), dtype=bool)
+
+        if invalid_logical.any():
+            if method_resolving_invalid_padding == "raise":
+                raise Exception("Invalid padding for {} region(s) (minimum length after padding: {}).".format(
+                    invalid_logical.sum(), 
+                    min_len_after_padding, 
+                ))
+            elif method_resolving_invalid_padding == "fallback":
+                padded_starts = np.where(invalid_logical, starts, padded_starts)
+                padded_ends = np.where(invalid_logical, ends, padded_ends)
+            elif method_resolving_invalid_padding == "drop":
+                valid_logical = ~invalid_logical
+            else:
+                raise Exception("Unsupported method to resolve invalid padding ({}).".format(method_resolving_invalid_padding))
+
+        return padded_starts, padded_ends, valid_logical
+
+    @staticmethod
+    def get_signal_cache_array_names():
+        '''
+        Return the names of the arrays stored in the signal cache 
+        for each chromosome, in the order of load_chrom_signal_cumsum outputs.
+        '''
+        return ["interval_starts", "interval_ends", "interval_values", "signal_cumsum"]
+
+    @staticmethod
+    def get_bw_signal_cache_dir(cache_dir, bw_path):
+        '''
+        Return the signal cache directory of a bigwig file. 
+        Cache directories are named by the real path of the bigwig. 
+        The cache of a bigwig is cleared if the file at that path 
+        changed: a different device or inode (the file was replaced), 
+        size, modification time or status change time (in place 
+        rewrites that keep the modification time, e.g. rsync -a --inplace).
+
+        Keyword arguments:
+        - cache_dir: root directory of the signal cache
+        - bw_path: path to the bigwig file
+        '''
+        bw_realpath = os.path.realpath(bw_path)
+        bw_stat = os.stat(bw_realpath)
+        bw_meta = {"path": bw_realpath, 
+                   "device": bw_stat.st_dev, 
+                   "inode": bw_stat.st_ino, 
+                   "size": bw_stat.st_size, 
+                   "mtime_ns": bw_stat.st_mtime_ns, 
+                   "ctime_ns": bw_stat.st_ctime_ns, 
+                   }
+
+        bw_cache_dir = os.path.join(cache_dir, hashlib.md5(bw_realpath.encode()).hexdigest())
+        meta_path = os.path.join(bw_cache_dir, "meta.json")
+
+        if os.path.exists(meta_path):
+            with open(meta_path, "r") as meta_f:
+                cached_bw_meta = json.load(meta_f)
+
+            if cached_bw_meta != bw_meta:
+                shutil.rmtree(bw_cache_dir, ignore_errors=True)
+
+        if not os.path.exists(meta_path):
+            # Arrays without meta.json cannot be matched to the bigwig 
+            # they were computed from. Temporary files of other 
+            # processes writing the same cache are left in place.
+            os.makedirs(bw_cache_dir, exist_ok=True)
+            for fn in os.listdir(bw_cache_dir):
+                if fn.endswith(".npy") and not ".tmp." in fn:
+                    try:
+                        os.remove(os.path.join(bw_cache_dir, fn))
+                    except FileNotFoundError:
+                        pass
+
+            temp_path = meta_path + ".{}.tmp".format(os.getpid())
+            with open(temp_path, "w") as meta_f:
+                json.dump(bw_meta, meta_f)
+            os.replace(temp_path, meta_path)
+
+        # The mtime of meta.json marks the last use for eviction
+        os.utime(meta_path)
+
+        return bw_cache_dir
+
+    @staticmethod
+    def read_cached_signal_cumsum(bw_cache_dir, chrom):
+        '''
+        Read the memory-mapped cumulative signal arrays of a chromosome 
+        from the signal cache. Returns None if the chromosome is not cached.
+        '''
+        cache_paths = [os.path.join(bw_cache_dir, "{}.{}.npy".format(chrom, array_name)) 
+                       for array_name in BwSignalCounter.get_signal_cache_array_names()]
+
+        if not all([os.path.exists(cache_path) for cache_path in cache_paths]):
+            return None
+
+        # The cache may be evicted by another process in between
+        try:
+            return tuple([np.load(cache_path, mmap_mode="r") for cache_path in cache_paths])
+        except FileNotFoundError:
+            return None
+
+    @staticmethod
+    def write_cached_signal_cumsum(bw_cache_dir, chrom, chrom_cumsum):
+        '''
+        Write the cumulative signal arrays of a chromosome to the signal cache.
+        Files are written to temporary paths first so that concurrent 
+        readers never see partial arrays. Nothing is written if the 
+        cache directory was evicted by another process.
+        '''
+        if not os.path.exists(os.path.join(bw_cache_dir, "meta.json")):
+            return
+
+        for array_name, arr in zip(BwSignalCounter.get_signal_cache_array_names(), chrom_cumsum):
+            cache_path = os.path.join(bw_cache_dir, "{}.{}.npy".format(chrom, array_name))
+            temp_path = cache_path + ".{}.tmp.npy".format(os.getpid())
+            try:
+                np.save(temp_path, arr)
+                os.replace(temp_path, cache_path)
+            except FileNotFoundError:
+                return
+
+    @staticmethod
+    def evict_signal_cache(cache_dir, cache_max_size):
+        '''
+        Remove the least recently used bigwig caches until the 
+        total size of the signal cache is below cache_max_size. 
+        Caches without meta.json are ordered by the modification 
+        time of their directory.
+
+        Keyword arguments:
+        - cache_dir: root directory of the signal cache
+        - cache_max_size: maximum size of the signal cache in GB
+        '''
+        cache_entry_list = []
+        for entry_name in os.listdir(cache_dir):
+            bw_cache_dir = os.path.join(cache_dir, entry_name)
+            if not os.path.isdir(bw_cache_dir):
+                continue
+
+            meta_path = os.path.join(bw_cache_dir, "meta.json")
+            last_use_path = meta_path if os.path.exists(meta_path) else bw_cache_dir
+
+            entry_size = sum([os.path.getsize(os.path.join(bw_cache_dir, fn)) for fn in os.listdir(bw_cache_dir)])
+            cache_entry_list.append((os.path.getmtime(last_use_path), entry_size, bw_cache_dir))
+
+        total_size = sum([entry_size for _, entry_size, _ in cache_entry_list])
+        for _, entry_size, bw_cache_dir in sorted(cache_entry_list):
+            if total_size <= cache_max_size * 1e9:
+                break
+
+            shutil.rmtree(bw_cache_dir, ignore_errors=True)
+            total_size -= entry_size
+
+    @staticmethod
+    def get_locality_order(chroms, starts):
+        '''
+        Return the indices that sort regions by (chrom, start), so 
+        that bigwig queries are made sequentially along the genome. 
+        Results computed in this order are scattered back with the 
+        same indices.
+
+        Keyword arguments:
+        - chroms: array-like chromosome names
+        - starts: array-like region starts
+        '''
+        return np.lexsort((np.asarray(starts), np.asarray(chroms, dtype=str)))
+
+    @staticmethod
+    def read_bw_zoom_index(bw_path):
+        '''
+        Read the header fields of a bigwig file needed to fetch 
+        zoom level records: the chromosome ids from the chromosome 
+        B+ tree and the R-tree index offset of each zoom level.
+
+        Returns a dict with
+        - byte_order: struct byte order of the file
+        - compressed: if data blocks are zlib compressed
+        - chrom_ids: dict of chromosome name to chromosome id
+        - zoom_levels: np.array of zoom level reduction levels
+        - zoom_index_offsets: list of R-tree offsets of the zoom levels
+        '''
+        with open(bw_path, "rb") as bw_f:
+            header = bw_f.read(64)
+            byte_order = "<" if struct.unpack("<I", header[:4])[0] == 0x888FFC26 else ">"
+            n_zoom_levels, chrom_tree_offset = struct.unpack_from(byte_order + "HQ", header, 6)
+            uncompress_buf_size = struct.unpack_from(byte_order + "I", header, 52)[0]
+
+            zoom_headers = bw_f.read(24 * n_zoom_levels)
+            zoom_levels = [struct.unpack_from(byte_order + "I", zoom_headers, 24 * i)[0] for i in range(n_zoom_levels)]
+            zoom_index_offsets = [struct.unpack_from(byte_order + "Q", zoom_headers, 24 * i + 16)[0] for i in range(n_zoom_levels)]
+
+            bw_f.seek(chrom_tree_offset)
+            # B+ tree header is 32 bytes, followed by the root node
+            key_size, val_size = struct.unpack_from(byte_order + "II", bw_f.read(32), 8)
+
+            chrom_ids = {}
+            node_offsets = [bw_f.tell()]
+            while node_offsets:
+                bw_f.seek(node_offsets.pop())
+                is_leaf, n_items = struct.unpack(byte_order + "BxH", bw_f.read(4))
+                for _ in range(n_items):
+                    key = bw_f.read(key_size).rstrip(b"\x00").decode()
+                    if is_leaf:
+                        chrom_ids[key] = struct.unpack(byte_order + "I", bw_f.read(val_size)[:4])[0]
+                    else:
+                        node_offsets.append(struct.unpack(byte_order + "Q", bw_f.read(8))[0])
+
+        return {"byte_order": byte_order, 
+                "compressed": uncompress_buf_size > 0, 
+                "chrom_ids": chrom_ids, 
+                "zoom_levels": np.array(zoom_levels, dtype=np.int64), 
+                "zoom_index_offsets": zoom_index_offsets, 
+                }
+
+    @staticmethod
+    def load_chrom_zoom_signal_cumsum(bw_f, bw_zoom_index, zoom_level_ind, chrom):
+        '''
+        Load all zoom level records of a chromosome from an opened 
+        bigwig file and build the cumulative signal array over the 
+        records. The signal in a record is assumed to be uniform.
+
+        Keyword arguments:
+        - bw_f: bigwig file opened in binary mode
+        - bw_zoom_index: output of read_bw_zoom_index
+        - zoom_level_ind: index of the zoom level in bw_zoom_index["zoom_levels"]
+        - chrom: chromosome name
+
+        Returns: same as load_chrom_signal_cumsum, with one interval per record.
+        '''
+        byte_order = bw_zoom_index["byte_order"]
+        record_dtype = np.dtype([("chrom_id", "u4"), ("start", "u4"), ("end", "u4"), ("valid_count", "u4"), 
+                                 ("min_val", "f4"), ("max_val", "f4"), ("sum_data", "f4"), ("sum_squares", "f4"), 
+                                 ]).newbyteorder(byte_order)
+
+        record_list = []
+        chrom_id = bw_zoom_index["chrom_ids"].get(chrom)
+        if chrom_id is not None:
+            # R-tree header is 48 bytes, followed by the root node
+            node_offsets = [bw_zoom_index["zoom_index_offsets"][zoom_level_ind] + 48]
+            while node_offsets:
+                bw_f.seek(node_offsets.pop())
+                is_leaf, n_items = struct.unpack(byte_order + "BxH", bw_f.read(4))
+                item_size = 32 if is_leaf else 24
+                items = bw_f.read(item_size * n_items)
+
+                block_list = []
+                for i in range(n_items):
+                    start_chrom_id, _, end_chrom_id, _, offset = struct.unpack_from(byte_order + "IIIIQ", items, item_size * i)
+                    if start_chrom_id > chrom_id or end_chrom_id < chrom_id:
+                        continue
+
+                    if is_leaf:
+                        block_list.append((offset, struct.unpack_from(byte_order + "Q", items, item_size * i + 24)[0]))
+                    else:
+                        node_offsets.append(offset)
+
+                for offset, size in block_list:
+                    bw_f.seek(offset)
+                    block = bw_f.read(size)
+                    if bw_zoom_index["compressed"]:
+                        block = zlib.decompress(block)
+                    records = np.frombuffer(block, dtype=record_dtype)
+                    record_list.append(records[records["chrom_id"] == chrom_id])
+
+        records = np.concatenate(record_list) if record_list else np.zeros(0, dtype=record_dtype)
+        records = records[np.argsort(records["start"], kind="stable")]
+
+        interval_starts = records["start"].astype(np.int64)
+        interval_ends = records["end"].astype(np.int64)
+        interval_values = np.abs(records["sum_data"].astype(np.float64)) / np.maximum(interval_ends - interval_starts, 1)
+
+        signal_cumsum = np.zeros(len(interval_starts) + 1, dtype=np.float64)
+        np.cumsum((interval_ends - interval_starts) * interval_values, 
+                  out=signal_cumsum[1:], 
+                  )
+
+        return interval_starts, interval_ends, interval_values, signal_cumsum
+
+    @staticmethod
+    def get_region_zoom_level_inds(zoom_levels, region_lens):
+        '''
+        Return the index into zoom_levels of the zoom level used to 
+        count each region: the coarsest one with bins no larger than 
+        1/8 of the region, so that the two partially overlapping bins 
+        at its ends cover at most 1/4 of the region. -1 for regions 
+        without a usable zoom level.
+        '''
+        zoom_levels = np.asarray(zoom_levels, dtype=np.int64)
+        region_lens = np.asarray(region_lens, dtype=np.int64)
+        if len(zoom_levels) == 0:
+            return np.full(len(region_lens), -1, dtype=np.int64)
+
+        zoom_level_order = np.argsort(zoom_levels, kind="stable")
+        sorted_inds = np.searchsorted(zoom_levels[zoom_level_order], region_lens // 8, side="right") - 1
+
+        return np.where(sorted_inds >= 0, zoom_level_order[np.clip(sorted_inds, 0, None)], -1)
+
+    @staticmethod
+    def clip_region_coords(chrom_sizes, chroms, starts, ends):
+        '''
+        Clip regions to [0, chromosome size). Regions on chromosomes 
+        not in chrom_sizes are kept as is.
+
+        Keyword arguments:
+        - chrom_sizes: dict of chromosome sizes, e.g. from pyBigWig chroms()
+        - chroms, starts, ends: np.array of region coordinates
+        '''
+        starts = np.asarray(starts, dtype=np.int64)
+        ends = np.asarray(ends, dtype=np.int64)
+
+        chrom_ends = np.array([chrom_sizes.get(chrom, -1) for chrom in chroms], dtype=np.int64)
+        chrom_ends = np.where(chrom_ends >= 0, chrom_ends, np.maximum(starts, ends))
+
+        clipped_starts = np.clip(starts, 0, chrom_ends)
+        clipped_ends = np.clip(ends, clipped_starts, chrom_ends)
+
+        return clipped_starts, clipped_ends
+
+    @staticmethod
+    def get_approximate_error_bounds(zoom_levels, region_lens):
+        '''
+        Return the expected relative error bound of approximate counting 
+        for each region, as the fraction of the region covered by the two 
+        partially overlapping zoom bins at its ends (signal in these bins 
+        is assumed to be uniform). The zoom level used for a 
+        region is selected by get_region_zoom_level_inds. Regions 
+        without a usable zoom level are counted exactly and have a bound of 0.
+
+        Keyword arguments:
+        - zoom_levels: np.array of zoom level reduction levels (see read_bw_zoom_index)
+        - region_lens: np.array of region lengths, clipped to the chromosome 
+                       (see clip_region_coords)
+        '''
+        region_lens = np.asarray(region_lens, dtype=np.int64)
+        zoom_levels = np.asarray(zoom_levels, dtype=np.int64)
+
+        zoom_level_inds = BwSignalCounter.get_region_zoom_level_inds(zoom_levels, region_lens)
+        bin_sizes = np.where(zoom_level_inds >= 0, 
+                             zoom_levels[np.clip(zoom_level_inds, 0, None)] if len(zoom_levels) else 0, 
+                             0, 
+                             )
+
+        return np.minimum(2 * bin_sizes / np.maximum(region_lens, 1), 1.)
+
+    @staticmethod
+    def count_bw_regions_from_zoom_levels(bw_path, chroms, starts, ends, region_inds, counts):
+        '''
+        Add the approximate signal of regions, computed from the zoom 
+        level records of a bigwig, to counts. Regions are clipped to 
+        the chromosome before the zoom level of each region is chosen 
+        (see get_region_zoom_level_inds). The records of each 
+        (chromosome, zoom level) are read once and regions are answered 
+        with the cumulative signal over the records.
+
+        Keyword arguments:
+        - bw_path: path to the bigwig
+        - chroms, starts, ends: np.array of region coordinates
+        - region_inds: indices of regions to count, sorted by (chrom, start)
+        - counts: np.array of counts updated in place
+        '''
+        bw = pyBigWig.open(bw_path)
+        chrom_sizes = bw.chroms()
+
+        starts, ends = BwSignalCounter.clip_region_coords(chrom_sizes, chroms, starts, ends)
+
+        bw_zoom_index = BwSignalCounter.read_bw_zoom_index(bw_path)
+        zoom_level_inds = BwSignalCounter.get_region_zoom_level_inds(bw_zoom_index["zoom_levels"], ends - starts)
+
+        sorted_chroms = chroms[region_inds]
+        chrom_boundaries = np.flatnonzero(sorted_chroms[1:] != sorted_chroms[:-1]) + 1
+
+        with open(bw_path, "rb") as bw_f:
+            for chrom_region_inds in np.split(region_inds, chrom_boundaries):
+                if len(chrom_region_inds) == 0:
+                    continue
+                chrom = chroms[chrom_region_inds[0]]
+                if not chrom in chrom_sizes:
+                    continue
+
+                chrom_starts = starts[chrom_region_inds]
+                chrom_ends = ends[chrom_region_inds]
+
+                for zoom_level_ind in np.unique(zoom_level_inds[chrom_region_inds]):
+                    level_logical = zoom_level_inds[chrom_region_inds] == zoom_level_ind
+
+                    if zoom_level_ind < 0:
+                        chrom_cumsum = BwSignalCounter.load_chrom_signal_cumsum(bw, chrom)
+                    else:
+                        chrom_cumsum = BwSignalCounter.load_chrom_zoom_signal_cumsum(bw_f, bw_zoom_index, zoom_level_ind, chrom)
+
+                    counts[chrom_region_inds[level_logical]] += \
+                        BwSignalCounter.query_signal_cumsum(*chrom_cumsum, chrom_ends[level_logical]) - \
+                        BwSignalCounter.query_signal_cumsum(*chrom_cumsum, chrom_starts[level_logical])
+
+        bw.close()
+
+    @staticmethod
+    def get_unique_region_inds(chroms, starts, ends, strands):
+        '''
+        Find identical (chrom, start, end, strand) queries.
+
+        Keyword arguments:
+        - chroms, starts, ends, strands: array-like region coordinates
+
+        Returns:
+        - unique_inds: index of the first occurrence of each unique region
+        - inverse_inds: index into unique_inds for every region, so that 
+                        unique_results[inverse_inds] broadcasts results back.
+        '''
+        region_key_df = pd.DataFrame({"chrom": np.asarray(chroms), 
+                                      "start": np.asarray(starts), 
+                                      "end": np.asarray(ends), 
+                                      "strand": np.asarray(strands), 
+                                      })
+
+        inverse_inds = region_key_df.groupby(list(region_key_df.columns), sort=False).ngroup().values
+        _, unique_inds = np.unique(inverse_inds, return_index=True)
+
+        return unique_inds, inverse_inds
+
+    @staticmethod
+    def count_bw_regions(bw_pl_path, bw_mn_path, single_bw, chroms, starts, ends, strands, 
+                         output_type="raw_count", l_pad=0, r_pad=0, min_len_after_padding=50, 
+                         method_resolving_invalid_padding="raise", cache_dir=None, approximate=False):
+        '''
+        Count signal in all regions with the batch counting engine. 
+        Regions are grouped by chromosome, the intervals of each 
+        chromosome are read once and every region is answered with 
+        the difference of the cumulative signal at its boundaries.
+
+        Plus strand regions are counted on the plus strand bigwig, 
+        minus strand regions on the minus strand bigwig and regions 
+        without strand information on both. Identical regions are 
+        only counted once.
+
+        Keyword arguments:
+        - bw_pl_path: path to the plus strand bigwig
+        - bw_mn_path: path to the minus strand bigwig
+        - single_bw: if only the plus strand bigwig is used
+        - chroms, starts, ends, strands: array-like region coordinates
+        - output_type: one of get_batch_quantification_types(), or a list of them. 
+                       All types are derived from the same signal sums.
+        - l_pad, r_pad, min_len_after_padding, method_resolving_invalid_padding: 
+            see pad_region_coords
+        - cache_dir: root directory of the signal cache (None to disable caching). 
+                     The cache is not evicted here, see evict_signal_cache.
+        - approximate: if to answer sums from the zoom level summaries of the bigwigs 
+                       instead of base resolution intervals (see get_approximate_error_bounds). 
+                       The signal cache is not used.
+
+        Returns:
+        - np.array of float64, NaN for dropped regions. 
+          2D with one column per type if output_type is a list.
+        '''
+        output_types = [output_type] if isinstance(output_type, str) else list(output_type)
+        for t in output_types:
+            if not t in BwSignalCounter.get_batch_quantification_types():
+                raise Exception("Unsupported output type for batch counting ({}).".format(t))
+
+        chroms = np.asarray(chroms, dtype=str)
+        strands = np.asarray(strands, dtype=str)
+        starts = np.asarray(starts)
+        ends = np.asarray(ends)
+
+        # Identical queries are counted once and broadcast back
+        unique_inds, inverse_inds = BwSignalCounter.get_unique_region_inds(chroms, starts, ends, strands)
+        if len(unique_inds) < len(chroms):
+            unique_counts = BwSignalCounter.count_bw_regions(bw_pl_path, 
+                                                             bw_mn_path, 
+                                                             single_bw, 
+                                                             chroms[unique_inds], 
+                                                             starts[unique_inds], 
+                                                             ends[unique_inds], 
+                                                             strands[unique_inds], 
+                                                             output_type=output_type, 
+                                                             l_pad=l_pad, 
+                                                             r_pad=r_pad, 
+                                                             min_len_after_padding=min_len_after_padding, 
+                                                             method_resolving_invalid_padding=method_resolving_invalid_padding, 
+                                                             cache_dir=cache_dir, 
+                                                             approximate=approximate, 
+                                                             )
+            return unique_counts[inverse_inds]
+
+        padded_starts, padded_ends, valid_logical = BwSignalCounter.pad_region_coords(starts, ends, 
+                                                                                      l_pad, r_pad, 
+                                                                                      min_len_after_padding, 
+                                                                                      method_resolving_invalid_padding, 
+                                                                                      )
+
+        if single_bw:
+            bw_strand_logical_list = [(bw_pl_path, np.ones(len(chroms), dtype=bool))]
+        else:
+            bw_strand_logical_list = [(bw_pl_path, strands != "-"), 
+                                      (bw_mn_path, strands != "+"), 
+                                      ]
+
+        counts = np.zeros(len(chroms), dtype=np.float64)
+        locality_order = BwSignalCounter.get_locality_order(chroms, padded_starts)
+
+        for bw_path, strand_logical in bw_strand_logical_list:
+            if approximate:
+                BwSignalCounter.count_bw_regions_from_zoom_levels(bw_path, 
+                                                                  chroms, 
+                                                                  padded_starts, 
+                                                                  padded_ends, 
+                                                                  locality_order[(strand_logical & valid_logical)[locality_order]], 
+                                                                  counts, 
+                                                                  )
+                continue
+
+            # The bigwig is only opened when a chromosome is not cached
+            bw = None
+            bw_cache_dir = BwSignalCounter.get_bw_signal_cache_dir(cache_dir, bw_path) if cache_dir else None
+
+            # Sorted region indices split into one block per chromosome
+            sorted_region_inds = locality_order[(strand_logical & valid_logical)[locality_order]]
+            sorted_chroms = chroms[sorted_region_inds]
+            chrom_boundaries = np.flatnonzero(sorted_chroms[1:] != sorted_chroms[:-1]) + 1
+
+            for region_inds in np.split(sorted_region_inds, chrom_boundaries):
+                if len(region_inds) == 0:
+                    continue
+                chrom = chroms[region_inds[0]]
+
+                chrom_cumsum = None
+                if bw_cache_dir:
+                    chrom_cumsum = BwSignalCounter.read_cached_signal_cumsum(bw_cache_dir, chrom)
+
+                if chrom_cumsum is None:
+                    if bw is None:
+                        bw = pyBigWig.open(bw_path)
+                    chrom_cumsum = BwSignalCounter.load_chrom_signal_cumsum(bw, chrom)
+
+                    if bw_cache_dir:
+                        BwSignalCounter.write_cached_signal_cumsum(bw_cache_dir, chrom, chrom_cumsum)
+
+                counts[region_inds] += BwSignalCounter.query_signal_cumsum(*chrom_cumsum, padded_ends[region_inds]) - \
+                    BwSignalCounter.query_signal_cumsum(*chrom_cumsum, padded_starts[region_inds])
+
+            if bw is not None:
+                bw.close()
+
+        counts[~valid_logical] = np.nan
+
+        if "CPM" in output_types or "RPKM" in output_types:
+            library_size = BwSignalCounter.get_bw_library_size(bw_pl_path, bw_mn_path, single_bw)
+
+        quantification_list = []
+        for t in output_types:
+            if t == "raw_count":
+                quantification_list.append(counts)
+            elif t == "RPK":
+                quantification_list.append(counts / (padded_ends - padded_starts) * 1e3)
+            elif t == "CPM":
+                quantification_list.append(counts / library_size * 1e6)
+            elif t == "RPKM":
+                quantification_list.append(counts / (padded_ends - padded_starts) * 1e3 / library_size * 1e6)
+
+        if isinstance(output_type, str):
+            return quantification_list[0]
+
+        return np.stack(quantification_list, axis=1)
+
+    @staticmethod
+    def count_bw_regions_by_track(bw_pl_path, bw_mn_path, single_bw, chroms, starts, ends, strands, 
+                                  output_type, l_pad=0, r_pad=0, min_len_after_padding=50, 
+                                  method_resolving_invalid_padding="raise"):
+        '''
+        Count signal region by region with BwTrack, for the 
+        output types not computed by the batch counting engine. 
+        Identical regions are only counted once and regions are 
+        queried in (chrom, start) order, with the queries of a 
+        region for all output types made back to back.
+
+        Keyword arguments: see count_bw_regions, output_type is one of 
+        BwTrack.get_supported_quantification_type() or a list of them.
+
+        Returns:
+        - np.array of float64 per output type, NaN for dropped regions. 
+          Output types with an array per region (e.g. full_track) 
+          have one row per region. A list of arrays is returned 
+          if output_type is a list.
+        '''
+        output_types = [output_type] if isinstance(output_type, str) else list(output_type)
+
+        chroms = np.asarray(chroms, dtype=str)
+        strands = np.asarray(strands, dtype=str)
+        starts = np.asarray(starts)
+        ends = np.asarray(ends)
+
+        bw_track = BwTrack(bw_pl_path=bw_pl_path,
+                           bw_mn_path=bw_mn_path,
+                           single_bw=single_bw,
+                           )
+
+        unique_inds, inverse_inds = BwSignalCounter.get_unique_region_inds(chroms, starts, ends, strands)
+
+        unique_output_lists = [[None] * len(unique_inds) for _ in output_types]
+        for k in BwSignalCounter.get_locality_order(chroms[unique_inds], starts[unique_inds]):
+            i = unique_inds[k]
+            for j, t in enumerate(output_types):
+                unique_output_lists[j][k] = bw_track.count_single_region(chroms[i],
+                                                                         starts[i],
+                                                                         ends[i],
+                                                                         strands[i],
+                                                                         t,
+                                                                         l_pad,
+                                                                         r_pad,
+                                                                         min_len_after_padding,
+                                                                         method_resolving_invalid_padding,
+                                                                         )
+
+        quantification_list = []
+        for unique_output_list in unique_output_lists:
+            # Dropped regions (None) are filled with NaN in the shape of the other outputs
+            output_shape = next((np.shape(o) for o in unique_output_list if o is not None), ())
+            unique_outputs = np.full((len(unique_inds), ) + output_shape, np.nan)
+            for k, o in enumerate(unique_output_list):
+                if o is not None:
+                    unique_outputs[k] = o
+
+            quantification_list.append(unique_outputs[inverse_inds])
+
+        if isinstance(output_type, str):
+            return quantification_list[0]
+
+        return quantification_list
+
+    @staticmethod
+    def get_count_dtypes():
+        '''
+        Return the supported data types of the count matrix.
+        '''
+        return ["float32", "float64"]
+
+    @staticmethod
+    def report_approximate_error_bounds(bw_paths, chroms, starts, ends):
+        '''
+        Return the largest approximate counting error bound over all 
+        bigwigs for each region (see get_approximate_error_bounds) 
+        and write a summary to stderr.
+
+        Keyword arguments:
+        - bw_paths: list of bigwig paths
+        - chroms, starts, ends: np.array of (padded) region coordinates, 
+                                clipped to the chromosomes of each bigwig
+        '''
+        error_bounds = np.zeros(len(chroms))
+        for bw_path in set(bw_paths):
+            bw = pyBigWig.open(bw_path)
+            clipped_starts, clipped_ends = BwSignalCounter.clip_region_coords(bw.chroms(), chroms, starts, ends)
+            bw.close()
+
+            zoom_levels = BwSignalCounter.read_bw_zoom_index(bw_path)["zoom_levels"]
+            error_bounds = np.maximum(error_bounds, 
+                                      BwSignalCounter.get_approximate_error_bounds(zoom_levels, 
+                                                                                   clipped_ends - clipped_starts, 
+                                                                                   ))
+
+        if len(error_bounds) > 0:
+            sys.stderr.write("Approximate counting expected relative error bound: "
+                             "median {:.3g}, max {:.3g}.\n".format(np.median(error_bounds), error_bounds.max()))
+
+        return error_bounds
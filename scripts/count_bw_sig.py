@@ -1,17 +1,21 @@
 #!/usr/bin/env python
 
 import os
-import re
 import sys
-import pyBigWig
+import json
+import shutil
 import argparse
+import tempfile
 import numpy as np
 import pandas as pd
 
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
 from RGTools.utils import str2bool
-from RGTools.BedTable import BedTable3, BedTable6, BedTable6Plus
+from RGTools.BedTable import BedTable6
 from RGTools.GenomicElements import GenomicElements
-from RGTools.BwTrack import BwTrack
+
+from bw_signal_counter import BwSignalCounter
 
 class CountBwSig:
     @staticmethod
@@ -21,25 +25,112 @@ class CountBwSig:
         '''
         return ["chrom_start_end", "name", "chrom_start_end_name"]
 
-    @staticmethod 
-    def get_region_id_converter(region_id_type):
+    @staticmethod
+    def get_region_ids(region_df, region_id_type):
         '''
-        Return a function that converts a region series to a region id 
-        based on the id type.
+        Build the region ids of all regions from the columns of 
+        the region df based on the id type. Duplicated ids are 
+        reported in the same pass.
 
         Keyword arguments:
+        - region_df: region df with chrom, start, end and name columns
         - region_id_type: type of the region id
+
+        Returns:
+        - pd.Index of region ids
         '''
         if region_id_type == "chrom_start_end":
-            return lambda x: x["chrom"] + "_" + str(x["start"]) + "_" + str(x["end"])
+            region_ids = region_df["chrom"].astype(str) + "_" + \
+                region_df["start"].astype(str) + "_" + \
+                region_df["end"].astype(str)
         elif region_id_type == "name":
-            return lambda x: x["name"]
+            region_ids = region_df["name"].astype(str)
         elif region_id_type == "chrom_start_end_name":
-            return lambda x: x["chrom"] + "_" + str(x["start"]) + "_" + str(x["end"]) + "_" + x["name"]
+            region_ids = region_df["chrom"].astype(str) + "_" + \
+                region_df["start"].astype(str) + "_" + \
+                region_df["end"].astype(str) + "_" + \
+                region_df["name"].astype(str)
         else:
             raise Exception("Unsupported region id type ({}).".format(region_id_type))
 
-    
+        region_ids = pd.Index(region_ids.values)
+
+        duplicated_logical = region_ids.duplicated()
+        if duplicated_logical.any():
+            sys.stderr.write("{} region(s) have duplicated region ids ({}), e.g. {}.\n".format(
+                duplicated_logical.sum(), 
+                region_id_type, 
+                region_ids[duplicated_logical][0], 
+            ))
+
+        return region_ids
+
+    @staticmethod
+    def count_sample(bw_pl_path, bw_mn_path, single_bw, chroms, starts, ends, strands, 
+                     output_types, l_pad, r_pad, min_len_after_padding, 
+                     method_resolving_invalid_padding, cache_dir=None, approximate=False, 
+                     dtype="float64"):
+        '''
+        Count signal of one sample in all regions for all output types. 
+        This is the unit of work sent to worker processes, 
+        so only numpy arrays are passed in and returned.
+
+        Output types of the batch counting engine are computed from 
+        a single pass over the bigwigs. Other types (e.g. PausingIndex) 
+        are not shared with the batch types: BwTrack queries every 
+        region once per type, with the queries of a region made 
+        back to back in (chrom, start) order. Identical regions are 
+        only counted once.
+
+        Keyword arguments: see count_bw_regions, output_types is a list. 
+        dtype is the data type of the returned counts, so that workers 
+        only send back counts in the data type of the count matrix.
+
+        Returns:
+        - np.array of shape (n_regions, n_output_types), NaN for dropped regions.
+        '''
+        counts = np.full((len(chroms), len(output_types)), np.nan)
+
+        batch_type_inds = [i for i, t in enumerate(output_types) if t in BwSignalCounter.get_batch_quantification_types()]
+        track_type_inds = [i for i, t in enumerate(output_types) if not t in BwSignalCounter.get_batch_quantification_types()]
+
+        if batch_type_inds:
+            counts[:, batch_type_inds] = BwSignalCounter.count_bw_regions(bw_pl_path, 
+                                                                          bw_mn_path, 
+                                                                          single_bw, 
+                                                                          chroms, 
+                                                                          starts, 
+                                                                          ends, 
+                                                                          strands, 
+                                                                          output_type=[output_types[i] for i in batch_type_inds], 
+                                                                          l_pad=l_pad, 
+                                                                          r_pad=r_pad, 
+                                                                          min_len_after_padding=min_len_after_padding, 
+                                                                          method_resolving_invalid_padding=method_resolving_invalid_padding, 
+                                                                          cache_dir=cache_dir, 
+                                                                          approximate=approximate, 
+                                                                          )
+
+        if not track_type_inds:
+            return counts.astype(dtype, copy=False)
+
+        track_counts_list = BwSignalCounter.count_bw_regions_by_track(bw_pl_path, 
+                                                                      bw_mn_path, 
+                                                                      single_bw, 
+                                                                      chroms, 
+                                                                      starts, 
+                                                                      ends, 
+                                                                      strands, 
+                                                                      [output_types[i] for i in track_type_inds], 
+                                                                      l_pad=l_pad, 
+                                                                      r_pad=r_pad, 
+                                                                      min_len_after_padding=min_len_after_padding, 
+                                                                      method_resolving_invalid_padding=method_resolving_invalid_padding, 
+                                                                      )
+        counts[:, track_type_inds] = np.stack(track_counts_list, axis=1)
+
+        return counts.astype(dtype, copy=False)
+
     @staticmethod
     def set_parser(parser):
         GenomicElements.set_parser_genomic_element_region(parser)
@@ -132,8 +223,13 @@ class CountBwSig:
                             )
         
         parser.add_argument("--output_type",
-                            help="What information is outputted. "
-                                "Options: [{}].".format(", ".join(BwTrack.get_supported_quantification_type())),
+                            help="What information is outputted. Comma separated list "
+                                "(e.g. raw_count,RPK) to output several types in one run. "
+                                "raw_count, RPK, CPM and RPKM share one pass over the bigwigs, "
+                                "other types query the bigwigs once per region and type. "
+                                "Regions dropped in any type are dropped in all. "
+                                "CPM and RPKM are normalized by the library size in the bigwig headers. "
+                                "Options: [{}].".format(", ".join(BwSignalCounter.get_supported_output_types())),
                             type=str,
                             default="raw_count",
                             dest="output_type",
@@ -147,19 +243,188 @@ class CountBwSig:
                             dest="region_id_type",
                             )
 
+        parser.add_argument("--processes", "--threads", 
+                            help="Number of worker processes. Samples are counted in parallel. [1]", 
+                            type=int, 
+                            default=1, 
+                            dest="processes", 
+                            )
+
+        parser.add_argument("--dtype", 
+                            help="Data type of the count matrix. [float64] "
+                                 "(Options: {}) float32 halves the memory "
+                                 "but is only exact for counts below 2^24.".format(", ".join(BwSignalCounter.get_count_dtypes())), 
+                            type=str, 
+                            default="float64", 
+                            dest="dtype", 
+                            )
+
+        parser.add_argument("--output_format", 
+                            help="Format of the output tables. [csv] "
+                                 "(Options: {}) parquet and hdf5 require "
+                                 "pyarrow and pytables.".format(", ".join(CountBwSig.get_output_format_suffix_dict().keys())), 
+                            type=str, 
+                            default="csv", 
+                            dest="output_format", 
+                            )
+
+        parser.add_argument("--cache_dir", 
+                            help="Directory of the on-disk signal cache. Per-chromosome cumulative "
+                                 "signal arrays of each bigwig are stored there and reused by later "
+                                 "runs ({} only). [None, no caching]".format(", ".join(BwSignalCounter.get_batch_quantification_types())), 
+                            type=str, 
+                            default=None, 
+                            dest="cache_dir", 
+                            )
+
+        parser.add_argument("--cache_max_size", 
+                            help="Maximum size of the signal cache in GB. Least recently used "
+                                 "bigwigs are evicted first. [20]", 
+                            type=float, 
+                            default=20, 
+                            dest="cache_max_size", 
+                            )
+
+        parser.add_argument("--chunk_size", 
+                            help="Number of regions read and counted at a time. Output is appended "
+                                 "chunk by chunk so memory does not grow with the number of regions. "
+                                 "The region file should be sorted, so that the output is the same as "
+                                 "reading all regions at once. Only supports csv output. "
+                                 "[None, read all regions at once]", 
+                            type=int, 
+                            default=None, 
+                            dest="chunk_size", 
+                            )
+
+        parser.add_argument("--checkpoint_dir", 
+                            help="Directory where the counts of each finished sample are saved. "
+                                 "[None, no checkpoints]", 
+                            type=str, 
+                            default=None, 
+                            dest="checkpoint_dir", 
+                            )
+
+        parser.add_argument("--resume", 
+                            help="If to reuse the checkpoints of samples whose inputs and "
+                                 "counting options are unchanged. [False]", 
+                            type=str2bool, 
+                            default=False, 
+                            dest="resume", 
+                            )
+
+        parser.add_argument("--approximate", 
+                            help="If to answer raw_count, RPK, CPM and RPKM from the zoom level summaries of the "
+                                 "bigwigs instead of base resolution signal. Much faster on wide regions. "
+                                 "Other output types are not supported. "
+                                 "The error bound of each region is written to the approx_error_bound "
+                                 "column of the region info. [False]", 
+                            type=str2bool, 
+                            default=False, 
+                            dest="approximate", 
+                            )
+
     @staticmethod
-    def write_output_table(count_df, region_df, output_type, opath, job_name):
+    def get_output_format_suffix_dict():
+        '''
+        Return the dict from output formats to file suffixes.
         '''
-        Write the output table.
+        return {"csv": "csv", 
+                "npz": "npz", 
+                "parquet": "parquet", 
+                "hdf5": "h5", 
+                }
+
+    @staticmethod
+    def write_df(df, opath_prefix, output_format, append=False):
         '''
-        if output_type == "RPK":
-            count_df.to_csv(os.path.join(opath, job_name + ".RPK.csv"))
-        elif output_type == "raw_count":
-            count_df.to_csv(os.path.join(opath, job_name + ".count.csv"))
-        elif output_type == "PausingIndex":
-            count_df.to_csv(os.path.join(opath, job_name + ".PI.csv"))
+        Write a dataframe in the output format.
 
-        region_df.to_csv(os.path.join(opath, job_name + ".region_info.csv"))
+        npz files hold "index" and "columns" arrays, and either a 
+        2D "values" array (count matrices) or one array per column 
+        named "column_<i>" (region info). They are written without 
+        compression so that CountTableTool.read_table can memory-map 
+        them.
+
+        Keyword arguments:
+        - df: dataframe to write
+        - opath_prefix: output path without suffix
+        - output_format: one of get_output_format_suffix_dict()
+        - append: if to append to an existing file (csv only)
+        '''
+        opath = opath_prefix + "." + CountBwSig.get_output_format_suffix_dict()[output_format]
+
+        if output_format == "csv":
+            df.to_csv(opath, 
+                      mode="a" if append else "w", 
+                      header=not append, 
+                      )
+            return
+
+        if append:
+            raise Exception("Appending is only supported for csv output.")
+
+        # Binary formats need homogeneous columns
+        df = df.copy()
+        for c in df.columns:
+            if df[c].dtype == object:
+                df[c] = df[c].astype(str)
+
+        if output_format == "npz":
+            output_dict = {"index": np.asarray(df.index, dtype=str), 
+                           "columns": np.asarray(df.columns, dtype=str), 
+                           }
+            if (df.dtypes == np.float32).all() or (df.dtypes == np.float64).all():
+                output_dict["values"] = df.values
+            else:
+                for i, c in enumerate(df.columns):
+                    column_arr = df[c].to_numpy()
+                    if column_arr.dtype == object:
+                        column_arr = np.asarray(column_arr, dtype=str)
+                    output_dict["column_{}".format(i)] = column_arr
+
+            np.savez(opath, **output_dict)
+        elif output_format == "parquet":
+            df.to_parquet(opath, compression="zstd")
+        elif output_format == "hdf5":
+            df.to_hdf(opath, key="table", mode="w", complevel=5, complib="zlib")
+
+    @staticmethod
+    def get_output_type_suffix_dict():
+        '''
+        Return the dict from output types to output file suffixes.
+        '''
+        return {"raw_count": "count", 
+                "RPK": "RPK", 
+                "PausingIndex": "PI", 
+                "CPM": "CPM", 
+                "RPKM": "RPKM", 
+                }
+
+    @staticmethod
+    def write_output_table(count_df_dict, region_df, opath, job_name, output_format="csv", 
+                           append=False):
+        '''
+        Write the output tables.
+
+        Keyword arguments:
+        - count_df_dict: dict from output types to count dfs
+        - region_df: region df
+        - opath: output directory
+        - job_name: output file prefix
+        - output_format: format of the output tables
+        - append: if to append to existing output tables
+        '''
+        for output_type, count_df in count_df_dict.items():
+            if not output_type in CountBwSig.get_output_type_suffix_dict().keys():
+                continue
+
+            CountBwSig.write_df(count_df, 
+                                os.path.join(opath, job_name + "." + CountBwSig.get_output_type_suffix_dict()[output_type]), 
+                                output_format, 
+                                append, 
+                                )
+
+        CountBwSig.write_df(region_df, os.path.join(opath, job_name + ".region_info"), output_format, append)
 
     @staticmethod
     def args_check_and_preprocessing(args):
@@ -176,9 +441,18 @@ class CountBwSig:
         - opath: output path
         - ignore_strandness: if to ignore strandness
         - region_padding: padding for each region (string format).
-        - output_type: what information is outputted
+        - output_type: list of what information is outputted
         - l_pad: left padding
         - r_pad: right padding
+        - processes: number of worker processes
+        - dtype: data type of the count matrix
+        - output_format: format of the output tables
+        - cache_dir: directory of the on-disk signal cache
+        - cache_max_size: maximum size of the signal cache in GB
+        - chunk_size: number of regions counted at a time
+        - checkpoint_dir: directory of per-sample checkpoints
+        - resume: if to reuse checkpoints
+        - approximate: if to count from zoom levels
         '''
         if args.single_bw:
             # set bw_mns the same as bw_pls for input consistency
@@ -200,8 +474,15 @@ class CountBwSig:
         if not args.region_file_type in GenomicElements.get_region_file_suffix2class_dict().keys():
             raise Exception("Unsupported region file type ({}).".format(args.region_file_type))
 
-        if not args.output_type in BwTrack.get_supported_quantification_type():
-            raise Exception("Unsupported output type ({}).".format(args.output_type))
+        if isinstance(args.output_type, str):
+            args.output_type = args.output_type.split(",")
+
+        for output_type in args.output_type:
+            if not output_type in BwSignalCounter.get_supported_output_types():
+                raise Exception("Unsupported output type ({}).".format(output_type))
+
+        if len(set(args.output_type)) != len(args.output_type):
+            raise Exception("Duplicated output types ({}).".format(",".join(args.output_type)))
 
         if not args.min_len_after_padding >= 1:
             raise Exception("Minimum length after padding should be positive.")
@@ -209,12 +490,52 @@ class CountBwSig:
         if not args.method_resolving_invalid_padding in ["raise", "fallback", "drop"]:
             raise Exception("Unsupported method to resolve invalid padding ({}).".format(args.method_resolving_invalid_padding))
 
-        if args.output_type == "PausingIndex" and (args.l_pad < 0 or args.r_pad < 0):
+        if "PausingIndex" in args.output_type and (args.l_pad < 0 or args.r_pad < 0):
             sys.stderr.write("Calculating pausing index with negative padding is not recommended.\n")
         
         if not args.region_id_type in CountBwSig.get_region_id_types():
             raise Exception("Unsupported region id type ({}).".format(args.region_id_type))
 
+        if not args.processes >= 1:
+            raise Exception("Number of processes should be positive.")
+
+        if not args.dtype in BwSignalCounter.get_count_dtypes():
+            raise Exception("Unsupported count matrix dtype ({}).".format(args.dtype))
+
+        if not args.output_format in CountBwSig.get_output_format_suffix_dict().keys():
+            raise Exception("Unsupported output format ({}).".format(args.output_format))
+
+        if args.chunk_size is not None:
+            if not args.chunk_size >= 1:
+                raise Exception("Chunk size should be positive.")
+
+            if args.output_format != "csv":
+                raise Exception("Chunked counting only supports csv output.")
+
+        if args.checkpoint_dir:
+            if args.chunk_size is not None:
+                raise Exception("Checkpoints are not supported in chunked counting.")
+
+            if len(set(args.sample_names)) != len(args.sample_names):
+                raise Exception("Sample names should be unique when using checkpoints.")
+
+            if not os.path.exists(args.checkpoint_dir):
+                os.makedirs(args.checkpoint_dir)
+
+        if args.approximate and args.cache_dir:
+            raise Exception("The signal cache is not used in approximate counting.")
+
+        if args.approximate:
+            for output_type in args.output_type:
+                if not output_type in BwSignalCounter.get_batch_quantification_types():
+                    raise Exception("Approximate counting does not support {}.".format(output_type))
+
+        if args.resume and not args.checkpoint_dir:
+            raise Exception("Checkpoint directory is required to resume.")
+
+        if args.cache_dir and not os.path.exists(args.cache_dir):
+            os.makedirs(args.cache_dir)
+
         return args
 
     def parse_region_input(region_file, file_type, region_id_type):
@@ -239,7 +560,15 @@ class CountBwSig:
                                            )
 
         region_bed_table=genomic_elements.get_region_bed_table()
-        
+
+        return CountBwSig.region_bed_table2region_df(region_bed_table, file_type, region_id_type)
+
+    @staticmethod
+    def region_bed_table2region_df(region_bed_table, file_type, region_id_type):
+        '''
+        Convert a region bed table to the region df described in 
+        parse_region_input.
+        '''
         if file_type == "bed3":
             new_region_bed_table = BedTable6()
             new_region_bed_table.load_from_BedTable3(region_bed_table)
@@ -248,52 +577,291 @@ class CountBwSig:
         #TODO: Switch from df to BedTables
         region_df = region_bed_table.to_dataframe()
         region_df.fillna(".", inplace=True)
-        region_df.index = region_df.agg(CountBwSig.get_region_id_converter(region_id_type), axis=1)
+        region_df.index = CountBwSig.get_region_ids(region_df, region_id_type)
 
         return region_df
 
     @staticmethod
-    def main(args):
-        args = CountBwSig.args_check_and_preprocessing(args)
+    def iter_region_input_chunks(region_file, file_type, region_id_type, chunk_size):
+        '''
+        Iterate over region dfs (see parse_region_input) of at most 
+        chunk_size regions each, reading the region file chunk by chunk. 
+
+        Chunks are loaded into the same bed table class as in parse_region_input, 
+        with the column types of that bed table. The region file must already 
+        be in the order this bed table sorts regions in, so that the chunks add 
+        up to the region df of parse_region_input row by row. An exception is 
+        raised otherwise.
+        '''
+        region_bed_table_class = GenomicElements.get_region_file_suffix2class_dict()[file_type]
+        region_bed_table = region_bed_table_class()
+
+        last_region_df = None
+        for chunk_df in pd.read_csv(region_file, 
+                                    sep="\t", 
+                                    header=None, 
+                                    names=region_bed_table.column_names, 
+                                    dtype=region_bed_table.column_types, 
+                                    chunksize=chunk_size, 
+                                    ):
+            # The last region of the previous chunk is loaded with the 
+            # chunk to check the order across chunk boundaries.
+            n_previous_regions = 0
+            if last_region_df is not None:
+                chunk_df = pd.concat([last_region_df, chunk_df], ignore_index=True)
+                n_previous_regions = 1
+            last_region_df = chunk_df.iloc[-1:]
+
+            chunk_bed_table = region_bed_table_class()
+            chunk_bed_table.load_from_dataframe(chunk_df)
+            sorted_chunk_df = chunk_bed_table.to_dataframe()
+
+            for column in ["chrom", "start", "end"]:
+                if not np.array_equal(sorted_chunk_df[column].values, chunk_df[column].values):
+                    raise Exception("Regions should be sorted in the region file for chunked counting.")
+
+            region_df = CountBwSig.region_bed_table2region_df(chunk_bed_table, file_type, region_id_type)
+
+            yield region_df.iloc[n_previous_regions:]
+
+    @staticmethod
+    def get_file_signature(file_path):
+        '''
+        Return the signature (real path, size and modification time) of a file.
+        '''
+        file_realpath = os.path.realpath(file_path)
+        file_stat = os.stat(file_realpath)
+
+        return {"path": file_realpath, 
+                "size": file_stat.st_size, 
+                "mtime_ns": file_stat.st_mtime_ns, 
+                }
+
+    @staticmethod
+    def get_sample_checkpoint_signature(args, bw_pl_path, bw_mn_path):
+        '''
+        Return the signature of the inputs of one sample. A checkpoint 
+        is only reused if its signature is identical.
+        '''
+        return {"bw_pl": CountBwSig.get_file_signature(bw_pl_path), 
+                "bw_mn": CountBwSig.get_file_signature(bw_mn_path), 
+                "region_file": CountBwSig.get_file_signature(args.region_file_path), 
+                "region_file_type": args.region_file_type, 
+                "single_bw": args.single_bw, 
+                "ignore_strandness": args.ignore_strandness, 
+                "output_type": args.output_type, 
+                "l_pad": args.l_pad, 
+                "r_pad": args.r_pad, 
+                "min_len_after_padding": args.min_len_after_padding, 
+                "method_resolving_invalid_padding": args.method_resolving_invalid_padding, 
+                "approximate": args.approximate, 
+                "dtype": args.dtype, 
+                }
+
+    @staticmethod
+    def read_sample_checkpoint(checkpoint_dir, sample, signature):
+        '''
+        Read the counts of a sample from the checkpoint directory.
+        Returns None if there is no checkpoint or the inputs changed.
+        '''
+        signature_path = os.path.join(checkpoint_dir, sample + ".json")
+        counts_path = os.path.join(checkpoint_dir, sample + ".npy")
+
+        if not (os.path.exists(signature_path) and os.path.exists(counts_path)):
+            return None
+
+        with open(signature_path, "r") as signature_f:
+            if json.load(signature_f) != signature:
+                return None
 
-        region_df = CountBwSig.parse_region_input(args.region_file_path, 
-                                                  args.region_file_type, 
-                                                  args.region_id_type, 
-                                                  )
+        return np.load(counts_path)
 
+    @staticmethod
+    def write_sample_checkpoint(checkpoint_dir, sample, signature, counts):
+        '''
+        Write the counts of a sample to the checkpoint directory. 
+        The signature is written last so that an interrupted write 
+        is never taken as a valid checkpoint.
+        '''
+        signature_path = os.path.join(checkpoint_dir, sample + ".json")
+        if os.path.exists(signature_path):
+            os.remove(signature_path)
+
+        np.save(os.path.join(checkpoint_dir, sample + ".npy"), counts)
+
+        with open(signature_path, "w") as signature_f:
+            json.dump(signature, signature_f)
+
+    @staticmethod
+    def count_region_df(region_df, args, executor=None):
+        '''
+        Count all samples in the regions of the region df.
+
+        Keyword arguments:
+        - region_df: region df (see parse_region_input)
+        - args: preprocessed arguments
+        - executor: process pool executor (None to count in this process)
+
+        Returns:
+        - count_df_dict: dict from output types to count dfs of regions that are not dropped
+        - region_df: region df of regions that are not dropped
+        '''
         if args.ignore_strandness:
             region_df["strand"] = "."
 
-        count_df = pd.DataFrame(index=region_df.index, 
-                                columns=args.sample_names, 
-                                dtype=int, 
-                                )
-
-        for sample ,bw_pl_path, bw_mn_path in zip(args.sample_names, args.bw_pls, args.bw_mns):
-            bed_track = BwTrack(bw_pl_path=bw_pl_path,
-                                bw_mn_path=bw_mn_path,
-                                single_bw=args.single_bw,
-                                )
+        count_mat = np.empty((region_df.shape[0], len(args.sample_names), len(args.output_type)), 
+                             dtype=args.dtype, 
+                             )
+
+        count_sample_args_list = [(bw_pl_path, 
+                                   bw_mn_path, 
+                                   args.single_bw, 
+                                   region_df["chrom"].values, 
+                                   region_df["start"].values, 
+                                   region_df["end"].values, 
+                                   region_df["strand"].values, 
+                                   args.output_type, 
+                                   args.l_pad, 
+                                   args.r_pad, 
+                                   args.min_len_after_padding, 
+                                   args.method_resolving_invalid_padding, 
+                                   args.cache_dir, 
+                                   args.approximate, 
+                                   args.dtype, 
+                                   ) for bw_pl_path, bw_mn_path in zip(args.bw_pls, args.bw_mns)]
+
+        checkpoint_signature_list = [None] * len(args.sample_names)
+        sample_inds_to_count = list(range(len(args.sample_names)))
+
+        if args.checkpoint_dir:
+            checkpoint_signature_list = [CountBwSig.get_sample_checkpoint_signature(args, bw_pl_path, bw_mn_path) 
+                                         for bw_pl_path, bw_mn_path in zip(args.bw_pls, args.bw_mns)]
+
+        if args.checkpoint_dir and args.resume:
+            sample_inds_to_count = []
+            for i, sample in enumerate(args.sample_names):
+                counts = CountBwSig.read_sample_checkpoint(args.checkpoint_dir, 
+                                                           sample, 
+                                                           checkpoint_signature_list[i], 
+                                                           )
+                if counts is None:
+                    sample_inds_to_count.append(i)
+                else:
+                    count_mat[:, i, :] = counts
+
+        def fill_sample_counts(i, counts):
+            count_mat[:, i, :] = counts
+
+            if args.checkpoint_dir:
+                CountBwSig.write_sample_checkpoint(args.checkpoint_dir, 
+                                                   args.sample_names[i], 
+                                                   checkpoint_signature_list[i], 
+                                                   counts, 
+                                                   )
+
+        if executor:
+            # At most one sample per process is in flight and each 
+            # result is released once it is copied into count_mat
+            future2sample_ind = {}
+
+            def fill_completed_sample_counts():
+                done_futures, _ = wait(future2sample_ind, return_when=FIRST_COMPLETED)
+                while done_futures:
+                    future = done_futures.pop()
+                    fill_sample_counts(future2sample_ind.pop(future), future.result())
+                    del future
+
+            for i in sample_inds_to_count:
+                if len(future2sample_ind) >= args.processes:
+                    fill_completed_sample_counts()
+
+                future2sample_ind[executor.submit(CountBwSig.count_sample, *count_sample_args_list[i])] = i
+
+            while future2sample_ind:
+                fill_completed_sample_counts()
+        else:
+            for i in sample_inds_to_count:
+                fill_sample_counts(i, CountBwSig.count_sample(*count_sample_args_list[i]))
+
+        if args.approximate:
+            padded_starts, padded_ends, _ = BwSignalCounter.pad_region_coords(region_df["start"].values, 
+                                                                              region_df["end"].values, 
+                                                                              args.l_pad, 
+                                                                              args.r_pad, 
+                                                                              args.min_len_after_padding, 
+                                                                              "fallback", 
+                                                                              )
+            region_df["approx_error_bound"] = BwSignalCounter.report_approximate_error_bounds(args.bw_pls + args.bw_mns, 
+                                                                                              region_df["chrom"].values, 
+                                                                                              padded_starts, 
+                                                                                              padded_ends, 
+                                                                                              )
+
+        valid_logical = ~np.isnan(count_mat).any(axis=(1, 2))
+        region_df = region_df.loc[valid_logical]
+
+        count_df_dict = {}
+        for type_ind, output_type in enumerate(args.output_type):
+            count_df_dict[output_type] = pd.DataFrame(count_mat[valid_logical, :, type_ind], 
+                                                      index=region_df.index, 
+                                                      columns=args.sample_names, 
+                                                      )
+
+        return count_df_dict, region_df
 
-            for region_id, region_info in region_df.iterrows():
-                count_df.loc[region_id, sample] = bed_track.count_single_region(region_info["chrom"],
-                                                                                region_info["start"],
-                                                                                region_info["end"],
-                                                                                region_info["strand"],
-                                                                                args.output_type,
-                                                                                args.l_pad,
-                                                                                args.r_pad,
-                                                                                args.min_len_after_padding,
-                                                                                args.method_resolving_invalid_padding,
-                                                                                )
-            
-        count_df.dropna(inplace=True,
-                        axis=0,
-                        )
-        
-        region_df = region_df.loc[count_df.index]
+    @staticmethod
+    def main(args):
+        args = CountBwSig.args_check_and_preprocessing(args)
 
-        CountBwSig.write_output_table(count_df, region_df, args.output_type, args.opath, args.job_name)
+        if args.chunk_size:
+            region_df_iter = CountBwSig.iter_region_input_chunks(args.region_file_path, 
+                                                                 args.region_file_type, 
+                                                                 args.region_id_type, 
+                                                                 args.chunk_size, 
+                                                                 )
+        else:
+            region_df_iter = [CountBwSig.parse_region_input(args.region_file_path, 
+                                                            args.region_file_type, 
+                                                            args.region_id_type, 
+                                                            )]
+
+        # Chunks are appended in a temporary directory and moved to 
+        # opath once all chunks are counted, so that an unsorted 
+        # region file does not leave partial tables behind.
+        output_dir = args.opath
+        if args.chunk_size:
+            output_dir = tempfile.mkdtemp(prefix="." + args.job_name + ".", dir=args.opath)
+
+        executor = ProcessPoolExecutor(max_workers=args.processes) if args.processes > 1 else None
+
+        try:
+            for chunk_ind, region_df in enumerate(region_df_iter):
+                count_df_dict, region_df = CountBwSig.count_region_df(region_df, args, executor=executor)
+
+                CountBwSig.write_output_table(count_df_dict, 
+                                              region_df, 
+                                              output_dir, 
+                                              args.job_name, 
+                                              output_format=args.output_format, 
+                                              append=chunk_ind > 0, 
+                                              )
+
+            if output_dir != args.opath:
+                for file_name in os.listdir(output_dir):
+                    os.replace(os.path.join(output_dir, file_name), 
+                               os.path.join(args.opath, file_name), 
+                               )
+
+            # Evicted once all workers are done, so that no worker 
+            # loses a bigwig cache it is writing to.
+            if args.cache_dir:
+                BwSignalCounter.evict_signal_cache(args.cache_dir, args.cache_max_size)
+        finally:
+            if executor:
+                executor.shutdown()
+
+            if output_dir != args.opath:
+                shutil.rmtree(output_dir, ignore_errors=True)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser("Extracting Counts from BWs")
@@ -5,12 +5,12 @@
 import argparse
 import sys
 import os
+import struct
+import zipfile
 
 import numpy as np
 import pandas as pd
 
-import statsmodels.api as sm
-
 from RGTools.BedTable import BedTable6, BedTable6Plus
 from RGTools.utils import str2bool, str2none
 
@@ -223,17 +223,93 @@ class CountTableTool:
                                             dest="region_info", 
                                             )
 
+    @staticmethod
+    def load_npz_arrays(input_path):
+        '''
+        Load the arrays of an npz file. Arrays stored without 
+        compression (np.savez) are memory-mapped read-only, 
+        np.load reads every array of an npz file into memory.
+
+        Returns:
+        - dict from array names to arrays
+        '''
+        array_dict = {}
+        with zipfile.ZipFile(input_path) as zip_f, open(input_path, "rb") as f:
+            for info in zip_f.infolist():
+                name = info.filename[:-len(".npy")]
+
+                if info.compress_type != zipfile.ZIP_STORED:
+                    with zip_f.open(info) as member_f:
+                        array_dict[name] = np.lib.format.read_array(member_f)
+                    continue
+
+                # The npy member starts after the local file header of the zip entry
+                f.seek(info.header_offset + 26)
+                name_len, extra_len = struct.unpack("<HH", f.read(4))
+                f.seek(info.header_offset + 30 + name_len + extra_len)
+
+                version = np.lib.format.read_magic(f)
+                if version == (1, 0):
+                    shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+                else:
+                    shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+
+                if dtype.hasobject or np.prod(shape) == 0:
+                    with zip_f.open(info) as member_f:
+                        array_dict[name] = np.lib.format.read_array(member_f, allow_pickle=False)
+                    continue
+
+                array_dict[name] = np.memmap(f, 
+                                             dtype=dtype, 
+                                             mode="r", 
+                                             offset=f.tell(), 
+                                             shape=shape, 
+                                             order="F" if fortran_order else "C", 
+                                             )
+
+        return array_dict
+
+    @staticmethod
+    def read_table(input_path):
+        '''
+        Read a table written by count_bw_sig.py. The format is 
+        determined by the suffix (.npz, .parquet, .h5/.hdf5, 
+        csv otherwise). npz values are memory-mapped, parquet, 
+        hdf5 and csv tables are read into memory.
+        '''
+        if input_path.endswith(".npz"):
+            npz_dict = CountTableTool.load_npz_arrays(input_path)
+            if "values" in npz_dict:
+                return pd.DataFrame(npz_dict["values"], 
+                                    index=npz_dict["index"], 
+                                    columns=npz_dict["columns"], 
+                                    copy=False, 
+                                    )
+
+            return pd.DataFrame({c: npz_dict["column_{}".format(i)] for i, c in enumerate(npz_dict["columns"])}, 
+                                index=npz_dict["index"], 
+                                copy=False, 
+                                )
+        elif input_path.endswith(".parquet"):
+            return pd.read_parquet(input_path, 
+                                   memory_map=True, 
+                                   )
+        elif input_path.endswith(".h5") or input_path.endswith(".hdf5"):
+            return pd.read_hdf(input_path, 
+                               key="table", 
+                               )
+        else:
+            return pd.read_csv(input_path, 
+                               index_col=0, 
+                               )
+
     @staticmethod
     def read_input_df(input_path):
-        return pd.read_csv(input_path, 
-                           index_col=0, 
-                           )
+        return CountTableTool.read_table(input_path)
 
     @staticmethod
     def read_region_info_df(region_info_path):
-        return pd.read_csv(region_info_path, 
-                           index_col=0, 
-                           )
+        return CountTableTool.read_table(region_info_path)
 
     @staticmethod
     def write_output_df(output_df, opath):
@@ -269,6 +345,8 @@ class CountTableTool:
         - Y: expression matrix. np.array with shape (n, 1).
         - missing: method handling missing values.
         '''
+        import statsmodels.api as sm
+
         X_df = pd.DataFrame(X, columns=["X1"])
         X_df = sm.add_constant(X_df["X1"])
 
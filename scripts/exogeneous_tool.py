@@ -9,12 +9,6 @@ import os
 import numpy as np
 import pandas as pd
 
-import matplotlib.pyplot as plt
-import matplotlib.patches as patches
-
-from Bio import SeqIO
-from scipy.spatial.distance import jensenshannon
-
 from RGTools.utils import NumpyEncoder
 from RGTools.BedTable import BedTable3, BedTable6Plus
 from RGTools.ExogeneousSequences import ExogeneousSequences
@@ -95,6 +89,30 @@ class ExogeneousTool:
                             required=True,
                             )
 
+        parser.add_argument("--pl_track_npy", 
+                            help="Plus strand signal tracks (npy), one row per region in the order of the "
+                                 "loaded region table, which may be sorted on load (the order of --region_out "
+                                 "before filtering). Rows of the kept regions are written to --pl_track_out.",
+                            default=None,
+                            )
+
+        parser.add_argument("--mn_track_npy", 
+                            help="Minus strand signal tracks (npy), one row per region in the order of the "
+                                 "loaded region table, which may be sorted on load (the order of --region_out "
+                                 "before filtering). Rows of the kept regions are written to --mn_track_out.",
+                            default=None,
+                            )
+
+        parser.add_argument("--pl_track_out", 
+                            help="Output path for filtered plus strand signal tracks.",
+                            default=None,
+                            )
+
+        parser.add_argument("--mn_track_out", 
+                            help="Output path for filtered minus strand signal tracks.",
+                            default=None,
+                            )
+
     @staticmethod
     def set_parser_compare_mutagenesis(parser):
         ExogeneousSequences.set_parser_exogeneous_sequences(parser)
@@ -174,6 +192,8 @@ class ExogeneousTool:
         - seq_ids: list of sequence ids
         - seqs: list of sequences
         '''
+        from Bio import SeqIO
+
         seq_ids = []
         seqs = []
 
@@ -221,6 +241,8 @@ class ExogeneousTool:
         Returns:
         - None
         '''
+        import matplotlib.patches as patches
+
         track2plot = track_arr.mean(axis=0)
         elem_size = len(track2plot)
 
@@ -326,48 +348,6 @@ class ExogeneousTool:
 
         return region_bt_w_anno
 
-    @staticmethod
-    def quantify_track_diff(pl_tracks_ref, mn_tracks_ref, 
-                            pl_tracks_mut, mn_tracks_mut):
-        '''
-        Quantify the difference between reference and mutated tracks
-        
-        Keyword arguments:
-        - pl_tracks_ref: plus strand tracks for reference sequences
-        - mn_tracks_ref: minus strand tracks for reference sequences
-        - pl_tracks_mut: plus strand tracks for mutated sequences
-        - mn_tracks_mut: minus strand tracks for mutated sequences
-
-        Returns:
-        - track_info_dict: dictionary containing track information
-        '''
-        track_info_dict = {}
-
-        assert pl_tracks_ref.shape == mn_tracks_ref.shape
-        assert pl_tracks_mut.shape == mn_tracks_mut.shape
-        assert pl_tracks_ref.shape[0] == 1
-
-        ref_log_total_count = np.log10(pl_tracks_ref.sum() - mn_tracks_ref.sum())
-        mut_log_total_count = np.log10(pl_tracks_mut.sum(axis=1) - mn_tracks_mut.sum(axis=1))
-        diff_log_total_count = mut_log_total_count - ref_log_total_count
-
-        track_info_dict["ref_log_total_count"] = ref_log_total_count
-        track_info_dict["mut_log_total_count"] = mut_log_total_count
-        track_info_dict["diff_log_total_count"] = abs(diff_log_total_count)
-        
-        track_info_dict["pl_ref_mut_jsd"] = jensenshannon(pl_tracks_ref, pl_tracks_mut, 
-                                                          axis=1, 
-                                                          )
-        track_info_dict["mn_ref_mut_jsd"] = jensenshannon(mn_tracks_ref, mn_tracks_mut, 
-                                                          axis=1, 
-                                                          )
-
-        track_info_dict["combined_ref_mut_jsd"] = jensenshannon(np.concatenate([pl_tracks_ref, -mn_tracks_ref], axis=1),
-                                                                np.concatenate([pl_tracks_mut, -mn_tracks_mut], axis=1),
-                                                                axis=1, 
-                                                                )
-        return track_info_dict
-    
     @staticmethod
     def plot_mutated_vs_ref_predicted_counts(ref_counts, mut_counts, opath=None):
         '''
@@ -381,6 +361,8 @@ class ExogeneousTool:
         Returns:
         - None
         '''
+        import matplotlib.pyplot as plt
+
         fig, ax = plt.subplots(1,1, 
                                figsize=(8,8), 
                                )
@@ -411,6 +393,8 @@ class ExogeneousTool:
         - jsd_arr: np.array of JSD values
         - opath: output path for the plot
         '''
+        import matplotlib.pyplot as plt
+
         fig, ax = plt.subplots(1,1, 
                                figsize=(8, 4), 
                                )
@@ -425,6 +409,8 @@ class ExogeneousTool:
 
     @staticmethod
     def metaplot_main(args):
+        import matplotlib.pyplot as plt
+
         exogeneous_seq = ExogeneousSequences(args.region_file_path, 
                                              args.region_file_type, 
                                              args.fasta,
@@ -457,35 +443,167 @@ class ExogeneousTool:
         fig.tight_layout()
         fig.savefig(args.outpath)
 
+    @staticmethod
+    def filter_track_npy(track_npy_path, keep_inds, opath, chunk_size=10000):
+        '''
+        Write the rows keep_inds of a npy track file to opath, 
+        reading the input through memmap chunk by chunk.
+        '''
+        track_arr = np.load(track_npy_path, mmap_mode="r")
+        output_arr = np.lib.format.open_memmap(opath, 
+                                               mode="w+", 
+                                               dtype=track_arr.dtype, 
+                                               shape=(len(keep_inds), ) + track_arr.shape[1:], 
+                                               )
+
+        for chunk_start in range(0, len(keep_inds), chunk_size):
+            chunk_inds = keep_inds[chunk_start:chunk_start + chunk_size]
+            output_arr[chunk_start:chunk_start + len(chunk_inds)] = track_arr[chunk_inds]
+
+        output_arr.flush()
+        del output_arr
+
     @staticmethod
     def filter_main(args):
+        from Bio import SeqIO
+
+        for track_npy, track_out in [(args.pl_track_npy, args.pl_track_out), 
+                                     (args.mn_track_npy, args.mn_track_out), 
+                                     ]:
+            if bool(track_npy) ^ bool(track_out):
+                raise ValueError("Track npy and its output path should be provided together.")
+
         exogeneous_seq = ExogeneousSequences(args.region_file_path, 
                                              args.region_file_type, 
                                              args.fasta,
                                              )
         region_bt = exogeneous_seq.get_region_bed_table()
 
+        regex = re.compile(args.regex)
+
+        region_df = region_bt.to_dataframe()
+        keep_logical = np.array([regex.match(seq_name) is not None for seq_name in region_df["chrom"].astype(str)], 
+                                dtype=bool, 
+                                )
+
         output_bt = region_bt._clone_empty()
-        output_df = pd.DataFrame(columns=output_bt.column_names)
+        output_bt.load_from_dataframe(region_df[keep_logical].reset_index(drop=True))
+        output_bt.write(args.region_out)
 
-        for region in region_bt.iter_regions():
-            seq_name = region["chrom"]
+        keep_inds = np.flatnonzero(keep_logical)
+        for track_npy, track_out in [(args.pl_track_npy, args.pl_track_out), 
+                                     (args.mn_track_npy, args.mn_track_out), 
+                                     ]:
+            if track_npy:
+                ExogeneousTool.filter_track_npy(track_npy, keep_inds, track_out)
 
-            if re.match(args.regex, seq_name):
-                output_df = pd.concat([output_df, 
-                                       pd.DataFrame(region.to_dict(), 
-                                                    columns=output_df.columns, 
-                                                    index=[output_df.shape[0]],
-                                                    ), 
-                                       ])
+        with open(args.fasta, "r") as input_f, open(args.fasta_out, "w") as output_f:
+            SeqIO.write((record for record in SeqIO.parse(input_f, "fasta") if regex.match(record.id)), 
+                        output_f, 
+                        "fasta", 
+                        )
 
-        output_bt.write(args.region_out)
+    @staticmethod
+    def group_ref_mut_regions(seq_ids, seq_types):
+        '''
+        Group regions by seq_id with a stable argsort.
+
+        Keyword arguments:
+        - seq_ids: np.array of seq_id of each region
+        - seq_types: np.array of seq_type (ref or mut) of each region
 
-        with open(args.fasta, "r") as input_f:
-            for record in SeqIO.parse(input_f, "fasta"):
-                if re.match(args.regex, record.id):
-                    with open(args.fasta_out, "a") as output_f:
-                        SeqIO.write(record, output_f, "fasta")
+        Returns:
+        - group_seq_ids: np.array of sorted seq_ids that have mutated sequences
+        - ref_inds: np.array of the reference region of each group
+        - mut_inds: np.array of mutated regions, grouped by seq_id 
+                    and in input order within each group
+        - mut_group_boundaries: np.array of length n_groups + 1, mutated regions 
+                                of group i are mut_inds[mut_group_boundaries[i]:mut_group_boundaries[i + 1]]
+        '''
+        order = np.argsort(seq_ids, kind="stable")
+        sorted_seq_ids = seq_ids[order]
+
+        group_starts = np.flatnonzero(np.concatenate([[True], sorted_seq_ids[1:] != sorted_seq_ids[:-1]]))
+        sorted_group_inds = np.repeat(np.arange(len(group_starts)), 
+                                      np.diff(np.append(group_starts, len(order))), 
+                                      )
+
+        sorted_ref_logical = seq_types[order] == "ref"
+        sorted_mut_logical = seq_types[order] == "mut"
+        num_refs = np.bincount(sorted_group_inds[sorted_ref_logical], minlength=len(group_starts))
+        num_muts = np.bincount(sorted_group_inds[sorted_mut_logical], minlength=len(group_starts))
+
+        # Groups without mutated sequences are skipped
+        kept_group_logical = num_muts > 0
+        if (num_refs[kept_group_logical] != 1).any():
+            bad_seq_id = sorted_seq_ids[group_starts][kept_group_logical & (num_refs != 1)][0]
+            raise ValueError("Sequence {} should have exactly one reference sequence.".format(bad_seq_id))
+
+        group_ref_inds = np.full(len(group_starts), -1, dtype=np.int64)
+        group_ref_inds[sorted_group_inds[sorted_ref_logical]] = order[sorted_ref_logical]
+
+        sorted_kept_mut_logical = sorted_mut_logical & kept_group_logical[sorted_group_inds]
+        mut_inds = order[sorted_kept_mut_logical]
+        mut_group_boundaries = np.concatenate([[0], np.cumsum(num_muts[kept_group_logical])])
+
+        return (sorted_seq_ids[group_starts][kept_group_logical], 
+                group_ref_inds[kept_group_logical], 
+                mut_inds, 
+                mut_group_boundaries, 
+                )
+
+    @staticmethod
+    def quantify_track_diff_batch(pl_tracks, mn_tracks, ref_inds, mut_inds, chunk_size=10000):
+        '''
+        Quantify the difference between reference and mutated tracks 
+        for many ref/mut pairs. Each mutated region mut_inds[i] is 
+        compared to the reference region ref_inds[i].
+
+        Keyword arguments:
+        - pl_tracks: plus strand tracks of all regions
+        - mn_tracks: minus strand tracks of all regions
+        - ref_inds: np.array of the reference region of each pair
+        - mut_inds: np.array of the mutated region of each pair
+        - chunk_size: number of pairs compared at a time
+
+        Returns:
+        - dictionary of np.array with one entry per pair: 
+          ref_log_total_count, mut_log_total_count, pl_ref_mut_jsd, 
+          mn_ref_mut_jsd and combined_ref_mut_jsd
+        '''
+        from scipy.spatial.distance import jensenshannon
+
+        log_total_count = np.log10(pl_tracks.sum(axis=1) - mn_tracks.sum(axis=1))
+
+        track_info_dict = {"ref_log_total_count": log_total_count[ref_inds], 
+                           "mut_log_total_count": log_total_count[mut_inds], 
+                           }
+
+        jsd_list_dict = {"pl_ref_mut_jsd": [], 
+                         "mn_ref_mut_jsd": [], 
+                         "combined_ref_mut_jsd": [], 
+                         }
+
+        for chunk_start in range(0, len(mut_inds), chunk_size):
+            chunk_ref_inds = ref_inds[chunk_start:chunk_start + chunk_size]
+            chunk_mut_inds = mut_inds[chunk_start:chunk_start + chunk_size]
+
+            pl_tracks_ref = pl_tracks[chunk_ref_inds]
+            mn_tracks_ref = mn_tracks[chunk_ref_inds]
+            pl_tracks_mut = pl_tracks[chunk_mut_inds]
+            mn_tracks_mut = mn_tracks[chunk_mut_inds]
+
+            jsd_list_dict["pl_ref_mut_jsd"].append(jensenshannon(pl_tracks_ref, pl_tracks_mut, axis=1))
+            jsd_list_dict["mn_ref_mut_jsd"].append(jensenshannon(mn_tracks_ref, mn_tracks_mut, axis=1))
+            jsd_list_dict["combined_ref_mut_jsd"].append(jensenshannon(np.concatenate([pl_tracks_ref, -mn_tracks_ref], axis=1),
+                                                                       np.concatenate([pl_tracks_mut, -mn_tracks_mut], axis=1),
+                                                                       axis=1, 
+                                                                       ))
+
+        for key, jsd_list in jsd_list_dict.items():
+            track_info_dict[key] = np.concatenate(jsd_list) if jsd_list else np.zeros(0)
+
+        return track_info_dict
 
     @staticmethod
     def compare_mutagenesis_main(args):
@@ -503,51 +621,58 @@ class ExogeneousTool:
         pl_tracks = np.load(args.pl_track_npy)
         mn_tracks = np.load(args.mn_track_npy)
 
-        seq_id_list = []
-        diff_dict_list = []
-        for seq_id in np.unique(region_bt_w_anno.get_region_extra_column("seq_id")):
-            ref_logical = (region_bt_w_anno.get_region_extra_column("seq_id") == seq_id) & \
-                (region_bt_w_anno.get_region_extra_column("seq_type") == "ref")
-            ref_logical = np.array(ref_logical, dtype=bool)
-            mut_logical = (region_bt_w_anno.get_region_extra_column("seq_id") == seq_id) & \
-                (region_bt_w_anno.get_region_extra_column("seq_type") == "mut")
-            mut_logical = np.array(mut_logical, dtype=bool)
-
-            if mut_logical.sum() == 0:
-                #TODO: add exception handling here
-                continue
-            
-            track_info_dict = ExogeneousTool.quantify_track_diff(pl_tracks[ref_logical, :], 
-                                                                 mn_tracks[ref_logical, :],
-                                                                 pl_tracks[mut_logical, :],
-                                                                 mn_tracks[mut_logical, :],
-                                                                 )
-        
-            seq_id_list.append(seq_id)
-            diff_dict_list.append(track_info_dict)
+        seq_id_list, ref_inds, mut_inds, mut_group_boundaries = ExogeneousTool.group_ref_mut_regions(
+            np.array(region_bt_w_anno.get_region_extra_column("seq_id"), dtype=str), 
+            np.array(region_bt_w_anno.get_region_extra_column("seq_type"), dtype=str), 
+        )
+
+        # One reference per mutated sequence
+        mut_ref_inds = np.repeat(ref_inds, np.diff(mut_group_boundaries))
+        batch_info_dict = ExogeneousTool.quantify_track_diff_batch(pl_tracks, 
+                                                                   mn_tracks, 
+                                                                   mut_ref_inds, 
+                                                                   mut_inds, 
+                                                                   )
+
+        ref_counts = batch_info_dict["ref_log_total_count"][mut_group_boundaries[:-1]]
+        diff_log_total_count = np.abs(batch_info_dict["mut_log_total_count"] - batch_info_dict["ref_log_total_count"])
+
+        for i, seq_id in enumerate(seq_id_list):
+            group_slice = slice(mut_group_boundaries[i], mut_group_boundaries[i + 1])
+
+            track_info_dict = {"ref_log_total_count": ref_counts[i], 
+                               "mut_log_total_count": batch_info_dict["mut_log_total_count"][group_slice], 
+                               "diff_log_total_count": diff_log_total_count[group_slice], 
+                               "pl_ref_mut_jsd": batch_info_dict["pl_ref_mut_jsd"][group_slice], 
+                               "mn_ref_mut_jsd": batch_info_dict["mn_ref_mut_jsd"][group_slice], 
+                               "combined_ref_mut_jsd": batch_info_dict["combined_ref_mut_jsd"][group_slice], 
+                               }
 
             with open(os.path.join(args.opath, seq_id + ".json"), "w") as output_f:
                 json.dump(track_info_dict, output_f, cls=NumpyEncoder)
 
         if args.total_count_plot_path:
-            ref_counts = np.array([d["ref_log_total_count"] for d in diff_dict_list])
-
-            mut_counts = []
-            for d in diff_dict_list:
-                largest_diff_ind = np.argmax(d["diff_log_total_count"])
-                mut_counts.append(d["mut_log_total_count"][largest_diff_ind])
-            
-            ExogeneousTool.plot_mutated_vs_ref_predicted_counts(np.array(ref_counts), 
-                                                                np.array(mut_counts), 
+            # Mutated sequence with the largest change of each group
+            largest_diff_inds = np.array([mut_group_boundaries[i] + np.argmax(diff_log_total_count[mut_group_boundaries[i]:mut_group_boundaries[i + 1]]) 
+                                          for i in range(len(seq_id_list))], 
+                                         dtype=np.int64, 
+                                         )
+            mut_counts = batch_info_dict["mut_log_total_count"][largest_diff_inds]
+
+            ExogeneousTool.plot_mutated_vs_ref_predicted_counts(ref_counts, 
+                                                                mut_counts, 
                                                                 opath=args.total_count_plot_path,
                                                                 )
         
         if args.jsd_distribution_plot_path:
-            largest_jsd = np.array([d["combined_ref_mut_jsd"].max() for d in diff_dict_list])
+            largest_jsd = np.maximum.reduceat(batch_info_dict["combined_ref_mut_jsd"], mut_group_boundaries[:-1]) \
+                if len(seq_id_list) else np.zeros(0)
             ExogeneousTool.plot_largest_jsd(largest_jsd, args.jsd_distribution_plot_path)
 
     @staticmethod
     def compute_track_correlation_main(args):
+        from scipy.spatial.distance import jensenshannon
+
         # input check
         if bool(args.mn_track1_npy) ^ bool(args.mn_track2_npy):
             raise ValueError("Either both or none of the minus strand tracks should be provided.")
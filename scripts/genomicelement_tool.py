@@ -1,14 +1,16 @@
 #!/usr/bin/env python
 
 import argparse
+import tempfile
 import sys
+import os
 
-import pandas as pd
 import numpy as np
 
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
 from RGTools.GenomicElements import GenomicElements
 from RGTools.exceptions import InvalidBedRegionException
-from RGTools.BwTrack import BwTrack
 from RGTools.utils import str2bool
 
 class GenomicElementTool:
@@ -37,22 +39,37 @@ class GenomicElementTool:
         GenomicElementTool.set_parser_bed2tssbed(parser_bed2tssbed)
 
         parser_onehot = subparsers.add_parser("onehot",
-                                              help="One-hot encode the sequence. Only support elements of the same size.",
+                                              help="One-hot encode the sequence.",
                                               )
         
         GenomicElementTool.set_parser_onehot(parser_onehot)
 
+        parser_profile = subparsers.add_parser("profile",
+                                               help="Binned signal profile of bigwig files. Only support elements of the same size.",
+                                               )
+
+        GenomicElementTool.set_parser_profile(parser_profile)
+
+        parser_extract_track = subparsers.add_parser("extract_track",
+                                                     help="Extract base resolution signal tracks from bigwig files. "
+                                                          "Only support elements of the same size.",
+                                                     )
+
+        GenomicElementTool.set_parser_extract_track(parser_extract_track)
+
     @staticmethod
     def set_parser_count_bw(parser):
         GenomicElements.set_parser_genomic_element_region(parser)
         parser.add_argument("--bw_pl",
-                            help="Plus strand bigwig file.",
+                            help="Plus strand bigwig file. Can be given multiple times, one per track.",
                             required=True,
+                            action="append",
                             type=str,
                             )
 
         parser.add_argument("--bw_mn",
-                            help="Minus strand bigwig file.",
+                            help="Minus strand bigwig file. Can be given multiple times, in the same order as --bw_pl.",
+                            action="append",
                             type=str,
                             default=None,
                             )
@@ -70,17 +87,64 @@ class GenomicElementTool:
                             )
 
         parser.add_argument("--quantification_type",
-                            help="Type of quantification.",
+                            help="Type of quantification, one of the output types of count_bw_sig.py. "
+                                 "raw_count, RPK, CPM and RPKM are counted from one pass over the bigwigs, "
+                                 "other types (e.g. PausingIndex, full_track) region by region. [raw_count]",
                             type=str,
                             default="raw_count",
-                            choices=BwTrack.get_supported_quantification_type(),
+                            )
+
+        parser.add_argument("--min_len_after_padding",
+                            help="Minimum length of a region. Shorter regions are resolved with "
+                                 "--method_resolving_invalid_padding. [50]",
+                            type=int,
+                            default=50,
+                            )
+
+        parser.add_argument("--method_resolving_invalid_padding",
+                            help="Method to resolve regions shorter than --min_len_after_padding. [raise]"
+                                 "Options: "
+                                 "- raise: raise an exception, "
+                                 "- fallback: count the region anyway, "
+                                 "- drop: output NaN for the region.",
+                            type=str,
+                            default="raise",
+                            choices=["raise", "fallback", "drop"],
                             )
 
         parser.add_argument("--opath",
-                            help="Output path for counting.",
+                            help="Output path for counting. The output has one column per track "
+                                 "if more than one track is given.",
                             required=True,
                             type=str,
                             )
+
+        parser.add_argument("--processes",
+                            help="Number of worker processes. Tracks are counted in parallel. [1]",
+                            type=int,
+                            default=1,
+                            )
+
+        parser.add_argument("--cache_dir",
+                            help="Directory of the on-disk signal cache shared with count_bw_sig.py "
+                                 "(raw_count, RPK, CPM and RPKM only). [None, no caching]",
+                            type=str,
+                            default=None,
+                            )
+
+        parser.add_argument("--cache_max_size",
+                            help="Maximum size of the signal cache in GB. [20]",
+                            type=float,
+                            default=20,
+                            )
+
+        parser.add_argument("--approximate",
+                            help="If to answer raw_count, RPK, CPM and RPKM from the zoom level summaries of the "
+                                 "bigwigs instead of base resolution signal. The expected error bound "
+                                 "is reported to stderr.",
+                            type=str2bool,
+                            default=False,
+                            )
     
     @staticmethod
     def set_parser_pad_region(parser):
@@ -140,27 +204,198 @@ class GenomicElementTool:
         GenomicElements.set_parser_genomic_element_region(parser)
 
         parser.add_argument("--opath",
-                            help="Output path for the one-hot encoded sequence.",
+                            help="Output path for the one-hot encoded sequence (.npy, uint8). "
+                                 "For the dense output, the shape is (n_elements, element_size, 4) "
+                                 "with bases in ACGT order, other bases are all zeros. "
+                                 "For the ragged output, this is the flat array of base codes "
+                                 "of all elements (0-3 for ACGT, 4 for other bases). "
+                                 "Minus strand elements are reverse complemented and positions "
+                                 "past the chromosome end are encoded as other bases.",
+                            type=str,
+                            required=True,
+                            )
+
+        parser.add_argument("--output_format",
+                            help="Output format. [dense] (Options: dense, ragged) "
+                                 "The dense output only supports elements of the same size. "
+                                 "The ragged output supports elements of any size, the codes of "
+                                 "element i are codes[offsets[i]:offsets[i + 1]].",
+                            type=str,
+                            default="dense",
+                            choices=["dense", "ragged"],
+                            )
+
+        parser.add_argument("--offsets_opath",
+                            help="Output path for the offsets (.npy, int64, n_elements + 1) of the ragged output.",
+                            type=str,
+                            default=None,
+                            )
+
+        parser.add_argument("--chunk_size",
+                            help="Number of elements encoded at a time. [10000]",
+                            type=int,
+                            default=10000,
+                            )
+
+        parser.add_argument("--workers",
+                            help="Number of worker processes. Each worker encodes a contiguous slice "
+                                 "of elements into the shared output. The base codes of the chromosomes "
+                                 "with elements are written to --tmp_dir for the workers, about 1 byte "
+                                 "per base (about 3 GB for a human genome). [1]",
+                            type=int,
+                            default=1,
+                            )
+
+        parser.add_argument("--tmp_dir",
+                            help="Directory of the temporary base codes shared with --workers. "
+                                 "[None, the system temporary directory, e.g. $TMPDIR]",
+                            type=str,
+                            default=None,
+                            )
+
+        parser.add_argument("--packbits",
+                            help="If to pack the one-hot bits of each element with np.packbits. "
+                                 "The output shape is then (n_elements, ceil(element_size / 2)). "
+                                 "Use np.unpackbits(arr, axis=1, count=element_size * 4) to restore.",
+                            type=str2bool,
+                            default=False,
+                            )
+
+    @staticmethod
+    def set_parser_profile(parser):
+        GenomicElements.set_parser_genomic_element_region(parser)
+        parser.add_argument("--bw_pl",
+                            help="Plus strand bigwig file. Can be given multiple times, one per track.",
+                            required=True,
+                            action="append",
+                            type=str,
+                            dest="bw_pls",
+                            )
+
+        parser.add_argument("--bw_mn",
+                            help="Minus strand bigwig file. Can be given multiple times, in the same order as --bw_pl.",
+                            action="append",
+                            type=str,
+                            dest="bw_mns",
+                            default=None,
+                            )
+
+        parser.add_argument("--single_bw",
+                            help="If there is only plus strand bigwig file.",
+                            type=str2bool,
+                            default=False,
+                            )
+
+        parser.add_argument("--override_strand",
+                            help="overide the strand information in the input file (None if use the input strand info).",
+                            type=str,
+                            default=None,
+                            )
+
+        parser.add_argument("--bin_size",
+                            help="Size of each bin. Must divide the size of the elements. [10]",
+                            type=int,
+                            default=10,
+                            )
+
+        parser.add_argument("--chunk_size",
+                            help="Maximum number of elements binned at a time. Fewer elements are "
+                                 "binned at a time if they would take more than 256 MB. [10000]",
+                            type=int,
+                            default=10000,
+                            )
+
+        parser.add_argument("--opath",
+                            help="Output path of the profile matrix (.npy) of shape "
+                                 "(n_elements, n_tracks, n_bins). Bins run from upstream "
+                                 "to downstream of each element.",
                             type=str,
                             required=True,
                             )
 
+    @staticmethod
+    def set_parser_extract_track(parser):
+        GenomicElements.set_parser_genomic_element_region(parser)
+        parser.add_argument("--bw_pl",
+                            help="Plus strand bigwig file.",
+                            required=True,
+                            type=str,
+                            )
+
+        parser.add_argument("--bw_mn",
+                            help="Minus strand bigwig file.",
+                            type=str,
+                            default=None,
+                            )
+
+        parser.add_argument("--single_bw",
+                            help="If there is only plus strand bigwig file. The minus strand output is all zeros.",
+                            type=str2bool,
+                            default=False,
+                            )
+
+        parser.add_argument("--override_strand",
+                            help="overide the strand information in the input file (None if use the input strand info).",
+                            type=str,
+                            default=None,
+                            )
+
+        parser.add_argument("--opath_pl",
+                            help="Output path of the plus strand tracks (.npy) of shape (n_elements, element_size).",
+                            type=str,
+                            required=True,
+                            )
+
+        parser.add_argument("--opath_mn",
+                            help="Output path of the minus strand tracks (.npy) of shape (n_elements, element_size). "
+                                 "Minus strand signal is negative.",
+                            type=str,
+                            required=True,
+                            )
+
+        parser.add_argument("--dtype",
+                            help="Data type of the output tracks. [float64] (Options: float32, float64)",
+                            type=str,
+                            default="float64",
+                            )
+
+        parser.add_argument("--chunk_size",
+                            help="Maximum number of elements extracted at a time. Fewer elements are "
+                                 "extracted at a time if they would take more than 256 MB. [10000]",
+                            type=int,
+                            default=10000,
+                            )
+
+        parser.add_argument("--processes",
+                            help="Number of worker processes. Chromosomes are extracted in parallel. [1]",
+                            type=int,
+                            default=1,
+                            )
 
     @staticmethod
     def get_bed2tssbed_output_site_types():
         return ["TSS", "center"]
 
     @staticmethod
-    def get_bed2tssbed_site_coord(region, output_site_type):
+    def get_bed2tssbed_site_coords(starts, ends, strands, output_site_type):
+        '''
+        Return the output site of every region as a np.array.
+
+        Keyword arguments:
+        - starts, ends, strands: np.array of region coordinates, 
+                                 strands is None for regions without strand
+        - output_site_type: one of get_bed2tssbed_output_site_types()
+        '''
         if output_site_type == "TSS":
-            if region["strand"] == "+":
-                site = region["start"]
-            elif region["strand"] == "-":
-                site = region["end"] - 1
+            if strands is None or not np.isin(strands, ["+", "-"]).all():
+                raise ValueError("Insufficient strand information!")
+            sites = np.where(strands == "+", starts, ends - 1)
         elif output_site_type == "center":
-            site = int((region["start"] + region["end"]) // 2)
+            sites = (starts + ends) // 2
+        else:
+            raise ValueError("Unrecognized output site type: {}".format(output_site_type))
         
-        return site
+        return sites
 
     @staticmethod
     def StrandInputType(string):
@@ -186,9 +421,43 @@ class GenomicElementTool:
             GenomicElementTool.bed2tssbed_main(args)
         elif args.subcommand == "onehot":
             GenomicElementTool.onehot_main(args)
+        elif args.subcommand == "profile":
+            GenomicElementTool.profile_main(args)
+        elif args.subcommand == "extract_track":
+            GenomicElementTool.extract_track_main(args)
         else:
             raise ValueError("Unknown subcommand: {}".format(args.subcommand))
 
+    @staticmethod
+    def get_padded_region_coords(starts, ends, strands, upstream_pad, downstream_pad):
+        '''
+        Pad all regions at once. Plus strand and unstranded (".") regions 
+        are padded upstream on the left, minus strand regions on the right.
+
+        Keyword arguments:
+        - starts, ends: np.array of region coordinates
+        - strands: np.array of region strands (None to ignore strand)
+        - upstream_pad, downstream_pad: padding to the upstream and downstream
+
+        Returns:
+        - padded_starts, padded_ends: np.array of padded coordinates
+        - valid_logical: np.array of bool, False for regions that are invalid after padding
+        '''
+        if strands is None:
+            minus_logical = np.zeros(len(starts), dtype=bool)
+        else:
+            invalid_strands = np.setdiff1d(strands, ["+", "-", "."])
+            if len(invalid_strands) > 0:
+                raise ValueError("Invalid strand value: {}".format(invalid_strands[0]))
+            minus_logical = strands == "-"
+
+        padded_starts = starts - np.where(minus_logical, downstream_pad, upstream_pad)
+        padded_ends = ends + np.where(minus_logical, upstream_pad, downstream_pad)
+
+        valid_logical = (padded_starts >= 0) & (padded_ends > padded_starts)
+
+        return padded_starts, padded_ends, valid_logical
+
     @staticmethod
     def pad_region_main(args):
         genomic_elements = GenomicElements(region_path=args.region_file_path,
@@ -197,63 +466,166 @@ class GenomicElementTool:
                                            )
         
         region_bt = genomic_elements.get_region_bed_table()
+        region_df = region_bt.to_dataframe()
 
-        output_dict_list = []
+        if args.ignore_strand or args.region_file_type == "bed3":
+            strands = None
+        else:
+            strands = np.array(region_df["strand"].values, dtype=str)
 
-        for i, region in enumerate(region_bt.iter_regions()):
-            try:
-                new_region = region.pad_region(upstream_padding=args.upstream_pad,
-                                               downstream_padding=args.downstream_pad,
-                                               ignore_strand=args.ignore_strand,
-                                               )
-            except InvalidBedRegionException as e:
-                if args.method_resolving_invalid_region == "raise":
-                    raise e
-                elif args.method_resolving_invalid_region == "fallback":
-                    new_region = region
-                elif args.method_resolving_invalid_region == "drop":
-                    continue
-                else:
-                    raise ValueError(f"Unknown method to resolve invalid region: {args.method_resolving_invalid_region}")
+        padded_starts, padded_ends, valid_logical = GenomicElementTool.get_padded_region_coords(region_df["start"].values, 
+                                                                                                region_df["end"].values, 
+                                                                                                strands, 
+                                                                                                args.upstream_pad, 
+                                                                                                args.downstream_pad, 
+                                                                                                )
+
+        if args.method_resolving_invalid_region == "raise":
+            if not valid_logical.all():
+                invalid_ind = np.flatnonzero(~valid_logical)[0]
+                raise InvalidBedRegionException("Invalid region after padding: {}:{}-{}".format(region_df["chrom"].values[invalid_ind], 
+                                                                                                padded_starts[invalid_ind], 
+                                                                                                padded_ends[invalid_ind], 
+                                                                                                ))
+        elif args.method_resolving_invalid_region == "fallback":
+            padded_starts = np.where(valid_logical, padded_starts, region_df["start"].values)
+            padded_ends = np.where(valid_logical, padded_ends, region_df["end"].values)
+            valid_logical = np.ones(len(region_df), dtype=bool)
+        elif args.method_resolving_invalid_region != "drop":
+            raise ValueError(f"Unknown method to resolve invalid region: {args.method_resolving_invalid_region}")
+
+        region_df["start"] = padded_starts
+        region_df["end"] = padded_ends
 
-            output_dict_list.append(new_region.to_dict())
-        
         output_region_bt = region_bt._clone_empty()
-        output_region_bt.load_from_dataframe(pd.DataFrame(output_dict_list,
-                                                          columns=region_bt.column_names,
-                                                          ))
+        output_region_bt.load_from_dataframe(region_df[valid_logical].reset_index(drop=True))
             
         output_region_bt.write(args.opath)
 
+    @staticmethod
+    def count_bw_track(bw_pl_path, bw_mn_path, single_bw, chroms, starts, ends, strands, 
+                       quantification_type, min_len_after_padding=50, 
+                       method_resolving_invalid_padding="raise", cache_dir=None, approximate=False):
+        '''
+        Count the signal of one bigwig track in all regions.
+
+        Keyword arguments:
+        - bw_pl_path, bw_mn_path, single_bw: bigwig files of the track
+        - chroms, starts, ends, strands: np.array of region coordinates
+        - quantification_type: one of BwSignalCounter.get_supported_output_types()
+        - min_len_after_padding, method_resolving_invalid_padding: 
+            applied the same way to all quantification types, 
+            see BwSignalCounter.pad_region_coords
+        - cache_dir, approximate: see BwSignalCounter.count_bw_regions
+
+        Returns:
+        - np.array with one entry per region, NaN for dropped regions
+        '''
+        from bw_signal_counter import BwSignalCounter
+
+        if quantification_type in BwSignalCounter.get_batch_quantification_types():
+            return BwSignalCounter.count_bw_regions(bw_pl_path, 
+                                                    bw_mn_path, 
+                                                    single_bw, 
+                                                    chroms, 
+                                                    starts, 
+                                                    ends, 
+                                                    strands, 
+                                                    output_type=quantification_type, 
+                                                    min_len_after_padding=min_len_after_padding, 
+                                                    method_resolving_invalid_padding=method_resolving_invalid_padding, 
+                                                    cache_dir=cache_dir, 
+                                                    approximate=approximate, 
+                                                    )
+
+        return BwSignalCounter.count_bw_regions_by_track(bw_pl_path, 
+                                                         bw_mn_path, 
+                                                         single_bw, 
+                                                         chroms, 
+                                                         starts, 
+                                                         ends, 
+                                                         strands, 
+                                                         quantification_type, 
+                                                         min_len_after_padding=min_len_after_padding, 
+                                                         method_resolving_invalid_padding=method_resolving_invalid_padding, 
+                                                         )
+
     @staticmethod
     def count_bw_main(args):
+        from bw_signal_counter import BwSignalCounter
+
+        if not args.quantification_type in BwSignalCounter.get_supported_output_types():
+            raise ValueError("Unsupported quantification type ({}).".format(args.quantification_type))
+
         genomic_elements = GenomicElements(region_path=args.region_file_path,
                                            region_file_type=args.region_file_type,
                                            fasta_path=None, 
                                            )
         region_bt = genomic_elements.get_region_bed_table()
 
-        bw_track = BwTrack(bw_pl_path=args.bw_pl,
-                           bw_mn_path=args.bw_mn,
-                           single_bw=args.single_bw,
-                           )
+        bw_pls = [args.bw_pl] if isinstance(args.bw_pl, str) else list(args.bw_pl)
+        if args.single_bw:
+            bw_mns = [None] * len(bw_pls)
+        else:
+            bw_mns = [args.bw_mn] if isinstance(args.bw_mn, str) or args.bw_mn is None else list(args.bw_mn)
+            if len(bw_mns) != len(bw_pls):
+                raise ValueError("Number of --bw_mn must match the number of --bw_pl.")
 
-        output_list = []
-        for region in region_bt.iter_regions():
-            if args.override_strand:
-                strand = args.override_strand
-            else:
-                strand = "." if args.region_file_type == "bed3" else region["strand"]
+        chroms = np.array(region_bt.get_chrom_names(), dtype=str)
+        starts = np.array(region_bt.get_start_locs())
+        ends = np.array(region_bt.get_end_locs())
+        strands = GenomicElementTool.get_region_strands(region_bt, args.region_file_type, args.override_strand)
+
+        if args.approximate and not args.quantification_type in BwSignalCounter.get_batch_quantification_types():
+            raise ValueError("Approximate counting does not support {}.".format(args.quantification_type))
+
+        if args.quantification_type in BwSignalCounter.get_batch_quantification_types():
+            if args.cache_dir and not os.path.exists(args.cache_dir):
+                os.makedirs(args.cache_dir)
+
+            if args.approximate:
+                BwSignalCounter.report_approximate_error_bounds(bw_pls if args.single_bw else bw_pls + bw_mns, 
+                                                                chroms, 
+                                                                starts, 
+                                                                ends, 
+                                                                )
+
+        count_args_list = [(bw_pl, 
+                            bw_mn, 
+                            args.single_bw, 
+                            chroms, 
+                            starts, 
+                            ends, 
+                            strands, 
+                            args.quantification_type, 
+                            args.min_len_after_padding, 
+                            args.method_resolving_invalid_padding, 
+                            args.cache_dir, 
+                            args.approximate, 
+                            ) for bw_pl, bw_mn in zip(bw_pls, bw_mns)]
+
+        track_output_list = [None] * len(count_args_list)
+        if args.processes > 1 and len(count_args_list) > 1:
+            with ProcessPoolExecutor(max_workers=args.processes) as executor:
+                future2track_ind = {executor.submit(GenomicElementTool.count_bw_track, *count_args): i
+                                    for i, count_args in enumerate(count_args_list)}
 
-            output_list.append(bw_track.count_single_region(region["chrom"],
-                                                            region["start"],
-                                                            region["end"],
-                                                            strand, 
-                                                            output_type=args.quantification_type,
-                                                            ),
-                               )
+                for future in as_completed(future2track_ind):
+                    track_output_list[future2track_ind[future]] = future.result()
+        else:
+            for i, count_args in enumerate(count_args_list):
+                track_output_list[i] = GenomicElementTool.count_bw_track(*count_args)
+
+        # Evicted once all tracks are counted, so that no worker 
+        # loses a bigwig cache it is writing to
+        if args.cache_dir and args.quantification_type in BwSignalCounter.get_batch_quantification_types():
+            BwSignalCounter.evict_signal_cache(args.cache_dir, args.cache_max_size)
 
-        output_arr = np.array(output_list)
+        # A single track keeps the one dimensional output
+        if len(track_output_list) == 1:
+            output_arr = track_output_list[0]
+        else:
+            output_arr = np.stack(track_output_list, axis=1)
 
         np.save(args.opath, output_arr)
     
@@ -265,32 +637,582 @@ class GenomicElementTool:
                                            )
         region_bt = genomic_elements.get_region_bed_table()
 
-        output_region_list = []
-        for region in region_bt.iter_regions():
-            output_coord = GenomicElementTool.get_bed2tssbed_site_coord(region, args.output_site)
-            
-            output_region_dict = region.to_dict()
-            output_region_dict["start"] = output_coord
-            output_region_dict["end"] = output_coord + 1
-            output_region_list.append(output_region_dict)
-
-        output_df = pd.DataFrame(output_region_list, 
-                                 columns=region_bt.column_names, 
-                                 )
+        output_df = region_bt.to_dataframe()
+
+        strands = None
+        if "strand" in output_df.columns:
+            strands = np.array(output_df["strand"].values, dtype=str)
+
+        output_coords = GenomicElementTool.get_bed2tssbed_site_coords(output_df["start"].values, 
+                                                                      output_df["end"].values, 
+                                                                      strands, 
+                                                                      args.output_site, 
+                                                                      )
+        output_df["start"] = output_coords
+        output_df["end"] = output_coords + 1
         
         output_bt = region_bt._clone_empty()
         output_bt.load_from_dataframe(output_df)
         output_bt.write(args.opath)
 
+    @staticmethod
+    def get_onehot_bases():
+        return ["A", "C", "G", "T"]
+
+    @staticmethod
+    def get_onehot_base_lut():
+        '''
+        Return the lookup table from ascii byte to base code. 
+        Bases in get_onehot_bases() (either case) are coded by their index, 
+        all other bytes by len(get_onehot_bases()).
+        '''
+        bases = GenomicElementTool.get_onehot_bases()
+
+        base_lut = np.full(256, len(bases), dtype=np.uint8)
+        for i, base in enumerate(bases):
+            base_lut[ord(base)] = i
+            base_lut[ord(base.lower())] = i
+
+        return base_lut
+
+    @staticmethod
+    def get_complement_base_codes(base_codes):
+        '''
+        Return the codes of the complementary bases. With the bases 
+        ordered as A, C, G, T (see get_onehot_bases()), the complement 
+        of code i is 3 - i. N is its own complement.
+        '''
+        n_bases = len(GenomicElementTool.get_onehot_bases())
+
+        return np.where(base_codes < n_bases, n_bases - 1 - base_codes, base_codes).astype(np.uint8)
+
+    @staticmethod
+    def iter_fasta_chrom_codes(fasta_path, chroms):
+        '''
+        Stream the fasta file and yield (chrom, base codes) 
+        for the chromosomes in chroms, one at a time.
+        '''
+        from Bio import SeqIO
+
+        base_lut = GenomicElementTool.get_onehot_base_lut()
+        chroms = set(chroms)
+
+        with open(fasta_path, "r") as fasta_f:
+            for record in SeqIO.parse(fasta_f, "fasta"):
+                if not record.id in chroms:
+                    continue
+
+                seq_bytes = np.frombuffer(str(record.seq).encode("ascii"), dtype=np.uint8)
+                yield record.id, base_lut[seq_bytes]
+
+    @staticmethod
+    def get_region_codes(chrom_codes, starts, region_len, minus_strand=None):
+        '''
+        Gather the base codes of regions of the same size from the codes 
+        of a chromosome. Positions outside of the chromosome are coded as N. 
+        Minus strand regions are reverse complemented.
+
+        Returns:
+        - np.array of uint8 of shape (n_regions, region_len)
+        '''
+        n_bases = len(GenomicElementTool.get_onehot_bases())
+
+        pos = starts[:, None] + np.arange(region_len, dtype=np.int64)[None, :]
+        in_chrom_logical = (pos >= 0) & (pos < len(chrom_codes))
+
+        region_codes = np.full(pos.shape, n_bases, dtype=np.uint8)
+        region_codes[in_chrom_logical] = chrom_codes[pos[in_chrom_logical]]
+
+        if minus_strand is not None and minus_strand.any():
+            region_codes[minus_strand] = GenomicElementTool.get_complement_base_codes(region_codes[minus_strand, ::-1])
+
+        return region_codes
+
+    @staticmethod
+    def encode_region_codes(region_codes, packbits=False):
+        '''
+        One-hot encode base codes of shape (n_regions, region_len) 
+        to (n_regions, region_len, 4), or to packed bits of shape 
+        (n_regions, ceil(region_len / 2)) if packbits.
+        '''
+        n_bases = len(GenomicElementTool.get_onehot_bases())
+        onehot_table = np.vstack([np.eye(n_bases, dtype=np.uint8), 
+                                  np.zeros((1, n_bases), dtype=np.uint8), 
+                                  ])
+
+        onehot_arr = onehot_table[region_codes]
+
+        if packbits:
+            return np.packbits(onehot_arr.reshape(len(onehot_arr), -1), axis=1)
+
+        return onehot_arr
+
+    @staticmethod
+    def get_ragged_region_codes(chrom_codes, starts, ends, minus_strand=None):
+        '''
+        Gather the base codes of regions of any size from the codes 
+        of a chromosome, concatenated in the order of the regions. 
+        Positions outside of the chromosome are coded as N. 
+        Minus strand regions are reverse complemented.
+
+        Returns:
+        - np.array of uint8 of shape (sum of region sizes,)
+        - np.array of the position of each base within its region
+        '''
+        n_bases = len(GenomicElementTool.get_onehot_bases())
+
+        region_lens = ends - starts
+        region_offsets = np.cumsum(region_lens) - region_lens
+        within_region_pos = np.arange(region_lens.sum(), dtype=np.int64) - np.repeat(region_offsets, region_lens)
+
+        pos = np.repeat(starts, region_lens) + within_region_pos
+        if minus_strand is not None:
+            base_minus_strand = np.repeat(minus_strand, region_lens)
+            pos = np.where(base_minus_strand, np.repeat(ends - 1, region_lens) - within_region_pos, pos)
+
+        in_chrom_logical = (pos >= 0) & (pos < len(chrom_codes))
+
+        region_codes = np.full(pos.shape, n_bases, dtype=np.uint8)
+        region_codes[in_chrom_logical] = chrom_codes[pos[in_chrom_logical]]
+
+        if minus_strand is not None:
+            region_codes = np.where(base_minus_strand, 
+                                    GenomicElementTool.get_complement_base_codes(region_codes), 
+                                    region_codes, 
+                                    ).astype(np.uint8)
+
+        return region_codes, within_region_pos
+
+    @staticmethod
+    def write_onehot_chunk(output_arr, chrom_codes, starts, ends, output_inds, 
+                           packbits=False, offsets=None, minus_strand=None):
+        '''
+        Encode a chunk of regions on the same chromosome into the output.
+
+        Keyword arguments:
+        - output_arr: dense one-hot output, or the flat code output if offsets is given
+        - chrom_codes: base codes of the chromosome
+        - starts, ends: np.array of region coordinates
+        - output_inds: np.array of the output row of each region
+        - packbits: see encode_region_codes
+        - offsets: np.array of the start of each row in the flat code output 
+                   (None for the dense output)
+        - minus_strand: np.array of bool, True for regions to reverse complement 
+                        (None to keep all regions on the plus strand)
+        '''
+        if offsets is None:
+            region_codes = GenomicElementTool.get_region_codes(chrom_codes, 
+                                                               starts, 
+                                                               int(ends[0] - starts[0]), 
+                                                               minus_strand=minus_strand, 
+                                                               )
+            output_arr[output_inds] = GenomicElementTool.encode_region_codes(region_codes, packbits=packbits)
+        else:
+            region_codes, within_region_pos = GenomicElementTool.get_ragged_region_codes(chrom_codes, 
+                                                                                         starts, 
+                                                                                         ends, 
+                                                                                         minus_strand=minus_strand, 
+                                                                                         )
+            output_arr[np.repeat(offsets[output_inds], ends - starts) + within_region_pos] = region_codes
+
+    @staticmethod
+    def check_onehot_chroms(chroms, encoded_chroms):
+        missing_chroms = set(chroms) - set(encoded_chroms)
+        if missing_chroms:
+            raise ValueError("Chromosomes not found in the fasta file: {}".format(", ".join(sorted(missing_chroms))))
+
+    @staticmethod
+    def onehot_encode_slice(chrom_code_dir, chroms, starts, ends, minus_strand, row_start, opath, 
+                            chunk_size=10000, packbits=False, offsets_opath=None):
+        '''
+        Encode a contiguous slice of elements into the preallocated output.
+
+        Keyword arguments:
+        - chrom_code_dir: directory of the base codes of each chromosome ({chrom}.npy)
+        - chroms, starts, ends: np.array of coordinates of the elements in the slice
+        - minus_strand: np.array of bool, True for elements to reverse complement
+        - row_start: output row of the first element in the slice
+        - opath: output npy file
+        - chunk_size: number of elements encoded at a time
+        - packbits: see encode_region_codes
+        - offsets_opath: offsets npy file of the ragged output (None for the dense output)
+        '''
+        output_arr = np.lib.format.open_memmap(opath, mode="r+")
+        offsets = np.load(offsets_opath, mmap_mode="r") if offsets_opath else None
+
+        chrom2codes = {}
+        for chunk_start in range(0, len(chroms), chunk_size):
+            chunk_chroms = chroms[chunk_start:chunk_start + chunk_size]
+
+            for chrom in np.unique(chunk_chroms):
+                if not chrom in chrom2codes:
+                    chrom2codes[chrom] = np.load(os.path.join(chrom_code_dir, "{}.npy".format(chrom)), 
+                                                 mmap_mode="r", 
+                                                 )
+
+                chrom_inds = chunk_start + np.flatnonzero(chunk_chroms == chrom)
+                GenomicElementTool.write_onehot_chunk(output_arr, 
+                                                      chrom2codes[chrom], 
+                                                      starts[chrom_inds], 
+                                                      ends[chrom_inds], 
+                                                      row_start + chrom_inds, 
+                                                      packbits=packbits, 
+                                                      offsets=offsets, 
+                                                      minus_strand=minus_strand[chrom_inds], 
+                                                      )
+
+        output_arr.flush()
+
     @staticmethod
     def onehot_main(args):
         genomic_elements = GenomicElements(region_path=args.region_file_path,
                                            region_file_type=args.region_file_type,
                                            fasta_path=args.fasta_path, 
                                            )
+        region_bt = genomic_elements.get_region_bed_table()
 
-        output_arr = genomic_elements.get_all_region_one_hot()
-        np.save(args.opath, output_arr)
+        chroms = np.array(region_bt.get_chrom_names(), dtype=str)
+        starts = np.array(region_bt.get_start_locs(), dtype=np.int64)
+        ends = np.array(region_bt.get_end_locs(), dtype=np.int64)
+        minus_strand = GenomicElementTool.get_region_strands(region_bt, args.region_file_type, None) == "-"
+
+        n_bases = len(GenomicElementTool.get_onehot_bases())
+        offsets = None
+        offsets_opath = None
+
+        if args.output_format == "ragged":
+            if args.packbits:
+                raise ValueError("--packbits is not supported for the ragged output.")
+            if not args.offsets_opath:
+                raise ValueError("--offsets_opath is required for the ragged output.")
+
+            offsets = np.zeros(len(region_bt) + 1, dtype=np.int64)
+            np.cumsum(ends - starts, out=offsets[1:])
+            np.save(args.offsets_opath, offsets)
+            offsets_opath = args.offsets_opath
+
+            output_shape = (int(offsets[-1]), )
+        elif args.output_format == "dense":
+            region_lens = np.unique(ends - starts)
+            if len(region_lens) > 1:
+                raise ValueError("All elements must be of the same size for the dense output.")
+            region_len = int(region_lens[0]) if len(region_lens) else 0
+
+            if args.packbits:
+                output_shape = (len(region_bt), (region_len * n_bases + 7) // 8)
+            else:
+                output_shape = (len(region_bt), region_len, n_bases)
+        else:
+            raise ValueError("Unknown output format: {}".format(args.output_format))
+
+        output_arr = np.lib.format.open_memmap(args.opath, 
+                                               mode="w+", 
+                                               dtype=np.uint8, 
+                                               shape=output_shape, 
+                                               )
+
+        if args.workers > 1:
+            output_arr.flush()
+            del output_arr
+
+            # Base codes are shared with the workers through npy files 
+            # so that no array is pickled between processes
+            with tempfile.TemporaryDirectory(dir=args.tmp_dir) as chrom_code_dir:
+                encoded_chroms = set()
+                for chrom, chrom_codes in GenomicElementTool.iter_fasta_chrom_codes(args.fasta_path, np.unique(chroms)):
+                    np.save(os.path.join(chrom_code_dir, "{}.npy".format(chrom)), chrom_codes)
+                    encoded_chroms.add(chrom)
+
+                GenomicElementTool.check_onehot_chroms(chroms, encoded_chroms)
+
+                slice_boundaries = np.linspace(0, len(chroms), args.workers + 1).astype(int)
+                with ProcessPoolExecutor(max_workers=args.workers) as executor:
+                    futures = [executor.submit(GenomicElementTool.onehot_encode_slice, 
+                                               chrom_code_dir, 
+                                               chroms[row_start:row_end], 
+                                               starts[row_start:row_end], 
+                                               ends[row_start:row_end], 
+                                               minus_strand[row_start:row_end], 
+                                               row_start, 
+                                               args.opath, 
+                                               args.chunk_size, 
+                                               args.packbits, 
+                                               offsets_opath, 
+                                               ) for row_start, row_end in zip(slice_boundaries[:-1], slice_boundaries[1:]) 
+                                                 if row_end > row_start]
+
+                    for future in as_completed(futures):
+                        future.result()
+
+            return
+
+        encoded_chroms = set()
+        for chrom, chrom_codes in GenomicElementTool.iter_fasta_chrom_codes(args.fasta_path, np.unique(chroms)):
+            region_inds = np.flatnonzero(chroms == chrom)
+
+            for chunk_start in range(0, len(region_inds), args.chunk_size):
+                chunk_inds = region_inds[chunk_start:chunk_start + args.chunk_size]
+
+                GenomicElementTool.write_onehot_chunk(output_arr, 
+                                                      chrom_codes, 
+                                                      starts[chunk_inds], 
+                                                      ends[chunk_inds], 
+                                                      chunk_inds, 
+                                                      packbits=args.packbits, 
+                                                      offsets=offsets, 
+                                                      minus_strand=minus_strand[chunk_inds], 
+                                                      )
+
+            encoded_chroms.add(chrom)
+
+        GenomicElementTool.check_onehot_chroms(chroms, encoded_chroms)
+
+        output_arr.flush()
+        del output_arr
+
+    @staticmethod
+    def fill_bw_profile(bw_path, chroms, starts, region_inds, bin_size, n_bins, 
+                        reverse_logical, output_arr, chunk_size=10000, 
+                        output_inds=None, sign=1, max_chunk_bytes=256 * 1024 ** 2):
+        '''
+        Add the binned signal of a bigwig to the output array.
+
+        Keyword arguments:
+        - bw_path: path to the bigwig
+        - chroms: np.array of chromosome names of all regions
+        - starts: np.array of starts of all regions
+        - region_inds: indices of the regions counted on this bigwig
+        - bin_size: size of each bin
+        - n_bins: number of bins per region
+        - reverse_logical: np.array of bool, if to reverse the bin order of a region (minus strand)
+        - output_arr: 2D array (n_regions, n_bins) to add the binned signal to
+        - chunk_size: maximum number of regions binned at a time
+        - output_inds: np.array of the output row of each region (None if the row is the region index)
+        - sign: sign of the binned signal added to the output
+        - max_chunk_bytes: memory budget of the temporary arrays of a chunk, 
+                           chunks of long regions hold fewer than chunk_size regions
+        '''
+        import pyBigWig
+
+        from bw_signal_counter import BwSignalCounter
+
+        # Querying a chunk holds about 8 temporary 64 bit values per bin boundary
+        chunk_size = max(1, min(chunk_size, max_chunk_bytes // (64 * (n_bins + 1))))
+
+        bw = pyBigWig.open(bw_path)
+
+        sorted_region_inds = region_inds[BwSignalCounter.get_locality_order(chroms[region_inds], starts[region_inds])]
+        sorted_chroms = chroms[sorted_region_inds]
+        chrom_boundaries = np.flatnonzero(sorted_chroms[1:] != sorted_chroms[:-1]) + 1
+
+        bin_offsets = np.arange(n_bins + 1, dtype=np.int64) * bin_size
+
+        for chrom_region_inds in np.split(sorted_region_inds, chrom_boundaries):
+            if len(chrom_region_inds) == 0:
+                continue
+            chrom_cumsum = BwSignalCounter.load_chrom_signal_cumsum(bw, chroms[chrom_region_inds[0]])
+
+            for chunk_start in range(0, len(chrom_region_inds), chunk_size):
+                chunk_inds = chrom_region_inds[chunk_start:chunk_start + chunk_size]
+
+                bin_boundaries = starts[chunk_inds, None] + bin_offsets[None, :]
+                bin_signal = np.diff(BwSignalCounter.query_signal_cumsum(*chrom_cumsum, bin_boundaries), axis=1)
+
+                chunk_reverse_logical = reverse_logical[chunk_inds]
+                bin_signal[chunk_reverse_logical] = bin_signal[chunk_reverse_logical, ::-1]
+
+                chunk_output_inds = chunk_inds if output_inds is None else output_inds[chunk_inds]
+                output_arr[chunk_output_inds] += sign * bin_signal
+
+        bw.close()
+
+    @staticmethod
+    def profile_main(args):
+        genomic_elements = GenomicElements(region_path=args.region_file_path,
+                                           region_file_type=args.region_file_type,
+                                           fasta_path=None, 
+                                           )
+        region_bt = genomic_elements.get_region_bed_table()
+
+        if not args.single_bw and (args.bw_mns is None or len(args.bw_mns) != len(args.bw_pls)):
+            raise ValueError("Number of --bw_mn must match the number of --bw_pl.")
+
+        chroms = np.array(region_bt.get_chrom_names(), dtype=str)
+        starts = np.array(region_bt.get_start_locs(), dtype=np.int64)
+        ends = np.array(region_bt.get_end_locs(), dtype=np.int64)
+
+        strands = GenomicElementTool.get_region_strands(region_bt, args.region_file_type, args.override_strand)
+
+        region_lens = np.unique(ends - starts)
+        if len(region_lens) > 1:
+            raise ValueError("All elements must be of the same size.")
+        region_len = int(region_lens[0]) if len(region_lens) else 0
+        if region_len % args.bin_size != 0:
+            raise ValueError("Bin size {} does not divide the element size {}.".format(args.bin_size, region_len))
+        n_bins = region_len // args.bin_size
+
+        output_arr = np.lib.format.open_memmap(args.opath, 
+                                               mode="w+", 
+                                               dtype=np.float64, 
+                                               shape=(len(region_bt), len(args.bw_pls), n_bins), 
+                                               )
+
+        reverse_logical = strands == "-"
+        all_region_inds = np.arange(len(region_bt))
+
+        # Bins are accumulated in place so that only one chunk is held in memory
+        for track_ind, bw_pl in enumerate(args.bw_pls):
+            if args.single_bw:
+                bw_region_inds_list = [(bw_pl, all_region_inds)]
+            else:
+                bw_region_inds_list = [(bw_pl, all_region_inds[strands != "-"]), 
+                                       (args.bw_mns[track_ind], all_region_inds[strands != "+"]), 
+                                       ]
+
+            for bw_path, region_inds in bw_region_inds_list:
+                GenomicElementTool.fill_bw_profile(bw_path, 
+                                                   chroms, 
+                                                   starts, 
+                                                   region_inds, 
+                                                   args.bin_size, 
+                                                   n_bins, 
+                                                   reverse_logical, 
+                                                   output_arr[:, track_ind, :], 
+                                                   chunk_size=args.chunk_size, 
+                                                   )
+
+        output_arr.flush()
+        del output_arr
+
+    @staticmethod
+    def get_region_strands(region_bt, region_file_type, override_strand):
+        '''
+        Return the strand of every region as a np.array. 
+        Regions of bed3 files are unstranded.
+        '''
+        if override_strand:
+            return np.full(len(region_bt), override_strand)
+        elif region_file_type == "bed3":
+            return np.full(len(region_bt), ".")
+        else:
+            return np.array(region_bt.get_region_strands(), dtype=str)
+
+    @staticmethod
+    def extract_chrom_track(bw_pl_path, bw_mn_path, single_bw, chrom, starts, strands, output_inds, 
+                            region_len, opath_pl, opath_mn, chunk_size=10000):
+        '''
+        Write the base resolution tracks of the regions of one chromosome 
+        into the preallocated output npy files.
+
+        Minus strand regions are flipped to the strand of the region: 
+        the plus strand output is the reversed minus strand signal and 
+        the minus strand output is the reversed plus strand signal.
+
+        Keyword arguments:
+        - bw_pl_path, bw_mn_path, single_bw: bigwig files
+        - chrom: chromosome name
+        - starts: np.array of region starts
+        - strands: np.array of region strands
+        - output_inds: np.array of the output row of each region
+        - region_len: size of the regions
+        - opath_pl, opath_mn: output npy files
+        - chunk_size: number of regions extracted at a time
+        '''
+        pl_output_arr = np.lib.format.open_memmap(opath_pl, mode="r+")
+        mn_output_arr = np.lib.format.open_memmap(opath_mn, mode="r+")
+
+        chroms = np.full(len(starts), chrom)
+        reverse_logical = strands == "-"
+        forward_inds = np.flatnonzero(~reverse_logical)
+        reverse_inds = np.flatnonzero(reverse_logical)
+
+        if single_bw:
+            fill_list = [(bw_pl_path, np.arange(len(starts)), pl_output_arr, 1)]
+        else:
+            fill_list = [(bw_pl_path, forward_inds, pl_output_arr, 1), 
+                         (bw_mn_path, reverse_inds, pl_output_arr, 1), 
+                         (bw_mn_path, forward_inds, mn_output_arr, -1), 
+                         (bw_pl_path, reverse_inds, mn_output_arr, -1), 
+                         ]
+
+        for bw_path, region_inds, output_arr, sign in fill_list:
+            GenomicElementTool.fill_bw_profile(bw_path, 
+                                               chroms, 
+                                               starts, 
+                                               region_inds, 
+                                               1, 
+                                               region_len, 
+                                               reverse_logical, 
+                                               output_arr, 
+                                               chunk_size=chunk_size, 
+                                               output_inds=output_inds, 
+                                               sign=sign, 
+                                               )
+
+        pl_output_arr.flush()
+        mn_output_arr.flush()
+
+    @staticmethod
+    def extract_track_main(args):
+        from bw_signal_counter import BwSignalCounter
+
+        if not args.dtype in BwSignalCounter.get_count_dtypes():
+            raise ValueError("Unsupported output dtype ({}).".format(args.dtype))
+
+        genomic_elements = GenomicElements(region_path=args.region_file_path,
+                                           region_file_type=args.region_file_type,
+                                           fasta_path=None, 
+                                           )
+        region_bt = genomic_elements.get_region_bed_table()
+
+        if not args.single_bw and args.bw_mn is None:
+            raise ValueError("--bw_mn is required unless --single_bw is set.")
+
+        chroms = np.array(region_bt.get_chrom_names(), dtype=str)
+        starts = np.array(region_bt.get_start_locs(), dtype=np.int64)
+        ends = np.array(region_bt.get_end_locs(), dtype=np.int64)
+        strands = GenomicElementTool.get_region_strands(region_bt, args.region_file_type, args.override_strand)
+
+        region_lens = np.unique(ends - starts)
+        if len(region_lens) > 1:
+            raise ValueError("All elements must be of the same size.")
+        region_len = int(region_lens[0]) if len(region_lens) else 0
+
+        # Preallocate the outputs, workers fill in the rows of their chromosome
+        for opath in [args.opath_pl, args.opath_mn]:
+            output_arr = np.lib.format.open_memmap(opath, 
+                                                   mode="w+", 
+                                                   dtype=args.dtype, 
+                                                   shape=(len(region_bt), region_len), 
+                                                   )
+            del output_arr
+
+        extract_args_list = []
+        for chrom in np.unique(chroms):
+            output_inds = np.flatnonzero(chroms == chrom)
+            extract_args_list.append((args.bw_pl, 
+                                      args.bw_mn, 
+                                      args.single_bw, 
+                                      chrom, 
+                                      starts[output_inds], 
+                                      strands[output_inds], 
+                                      output_inds, 
+                                      region_len, 
+                                      args.opath_pl, 
+                                      args.opath_mn, 
+                                      args.chunk_size, 
+                                      ))
+
+        if args.processes > 1:
+            with ProcessPoolExecutor(max_workers=args.processes) as executor:
+                futures = [executor.submit(GenomicElementTool.extract_chrom_track, *extract_args) 
+                           for extract_args in extract_args_list]
+
+                for future in as_completed(futures):
+                    future.result()
+        else:
+            for extract_args in extract_args_list:
+                GenomicElementTool.extract_chrom_track(*extract_args)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Genomic element tool.")
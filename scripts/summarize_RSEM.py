@@ -7,10 +7,6 @@ import argparse
 
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-
-from sklearn.decomposition import PCA
-from umap import UMAP
 
 def set_parser(parser):
     parser.add_argument("--inpath", 
@@ -125,7 +121,12 @@ def main(args):
     if args.tpm_opath:
         tpm_df.to_csv(args.tpm_opath)
     
+    if args.pca_opath or args.umap_opath:
+        import matplotlib.pyplot as plt
+
     if args.pca_opath:
+        from sklearn.decomposition import PCA
+
         fig, ax = plt.subplots(1,1)
         pca = PCA(n_components=2)
         make_dim_reduction_plot(data_df=tpm_df, 
@@ -138,6 +139,8 @@ def main(args):
         fig.savefig(args.pca_opath)
 
     if args.umap_opath:
+        from umap import UMAP
+
         fig, ax = plt.subplots(1,1)
         umap = UMAP(n_components=2, 
                     n_neighbors=5, 
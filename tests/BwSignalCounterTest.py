@@ -0,0 +1,230 @@
+import unittest
+import shutil
+import sys
+import os
+
+import numpy as np
+
+sys.path.append("scripts")
+from scripts.bw_signal_counter import BwSignalCounter
+from scripts.RGTools.BwTrack import BwTrack
+
+class BwSignalCounterTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.__bw_pls = ["sample_data/ENCFF993VCR.pl.bigWig"]
+        self.__bw_mns = ["sample_data/ENCFF182TPF.mn.bigWig"]
+
+        self.__temp_dir = "BwSignalCounterTest_temp"
+        if not os.path.exists(self.__temp_dir):
+            os.makedirs(self.__temp_dir)
+
+        return super().setUp()
+
+    def tearDown(self) -> None:
+        if os.path.exists(self.__temp_dir):
+            shutil.rmtree(self.__temp_dir)
+
+        return super().tearDown()
+
+    def test_get_bw_signal_cache_dir(self):
+        cache_dir = os.path.join(self.__temp_dir, "signal_cache")
+        bw_path = os.path.join(self.__temp_dir, "track.bw")
+        with open(bw_path, "w") as bw_f:
+            bw_f.write("track")
+
+        bw_cache_dir = BwSignalCounter.get_bw_signal_cache_dir(cache_dir, bw_path)
+        BwSignalCounter.write_cached_signal_cumsum(bw_cache_dir, "chr1", [np.arange(3)] * 4)
+        self.assertIsNotNone(BwSignalCounter.read_cached_signal_cumsum(bw_cache_dir, "chr1"))
+
+        # Replacing the file with one of the same size and modification time clears the cache
+        bw_stat = os.stat(bw_path)
+        replacement_path = os.path.join(self.__temp_dir, "replacement.bw")
+        with open(replacement_path, "w") as bw_f:
+            bw_f.write("kcart")
+        os.utime(replacement_path, ns=(bw_stat.st_atime_ns, bw_stat.st_mtime_ns))
+        os.replace(replacement_path, bw_path)
+
+        self.assertEqual(BwSignalCounter.get_bw_signal_cache_dir(cache_dir, bw_path), bw_cache_dir)
+        self.assertIsNone(BwSignalCounter.read_cached_signal_cumsum(bw_cache_dir, "chr1"))
+
+        # Arrays left without meta.json are cleared, and counted for eviction
+        BwSignalCounter.write_cached_signal_cumsum(bw_cache_dir, "chr1", [np.arange(3)] * 4)
+        os.remove(os.path.join(bw_cache_dir, "meta.json"))
+        BwSignalCounter.evict_signal_cache(cache_dir, 1e-9)
+        self.assertFalse(os.path.exists(bw_cache_dir))
+
+        os.makedirs(bw_cache_dir)
+        np.save(os.path.join(bw_cache_dir, "chr1.signal_cumsum.npy"), np.arange(3))
+        self.assertEqual(BwSignalCounter.get_bw_signal_cache_dir(cache_dir, bw_path), bw_cache_dir)
+        self.assertEqual(os.listdir(bw_cache_dir), ["meta.json"])
+
+    def test_query_signal_cumsum(self):
+        interval_starts = np.array([10, 20, 30])
+        interval_ends = np.array([15, 22, 40])
+        interval_values = np.array([1., 2., 3.])
+        signal_cumsum = np.array([0., 5., 9., 39.])
+
+        signal = BwSignalCounter.query_signal_cumsum(interval_starts, 
+                                                     interval_ends, 
+                                                     interval_values, 
+                                                     signal_cumsum, 
+                                                     np.array([0, 12, 18, 21, 35, 100]), 
+                                                     )
+
+        self.assertTrue(np.allclose(signal, [0, 2, 5, 7, 24, 39]))
+
+    def test_count_bw_regions(self):
+        chroms = np.array(["chr6", "chr14", "chr17", "chr6"])
+        starts = np.array([170553801, 75278325, 45894026, 170553801])
+        ends = np.array([170554802, 75279326, 45895027, 170554802])
+        strands = np.array(["+", "-", "+", "."])
+
+        bw_track = BwTrack(bw_pl_path=self.__bw_pls[0], 
+                           bw_mn_path=self.__bw_mns[0], 
+                           single_bw=False, 
+                           )
+
+        for output_type in ["raw_count", "RPK"]:
+            counts = BwSignalCounter.count_bw_regions(self.__bw_pls[0], 
+                                                      self.__bw_mns[0], 
+                                                      False, 
+                                                      chroms, 
+                                                      starts, 
+                                                      ends, 
+                                                      strands, 
+                                                      output_type=output_type, 
+                                                      l_pad=-100, 
+                                                      r_pad=50, 
+                                                      min_len_after_padding=1, 
+                                                      )
+
+            for i in range(len(chroms)):
+                self.assertAlmostEqual(counts[i], 
+                                       bw_track.count_single_region(chroms[i], 
+                                                                    starts[i], 
+                                                                    ends[i], 
+                                                                    strands[i], 
+                                                                    output_type, 
+                                                                    -100, 
+                                                                    50, 
+                                                                    1, 
+                                                                    "raise", 
+                                                                    ), 
+                                       )
+
+        counts = BwSignalCounter.count_bw_regions(self.__bw_pls[0], 
+                                                  self.__bw_mns[0], 
+                                                  False, 
+                                                  chroms, 
+                                                  starts, 
+                                                  ends, 
+                                                  strands, 
+                                                  )
+        self.assertEqual(counts[0], 348)
+        self.assertEqual(counts[3], 379)
+
+    def test_count_bw_regions_by_track(self):
+        chroms = np.array(["chr6", "chr14", "chr6"])
+        starts = np.array([170553801, 75278325, 170553801])
+        ends = np.array([170554802, 75278335, 170554802])
+        strands = np.array(["+", "-", "+"])
+
+        full_track, pausing_index = BwSignalCounter.count_bw_regions_by_track(self.__bw_pls[0], 
+                                                                              self.__bw_mns[0], 
+                                                                              False, 
+                                                                              chroms, 
+                                                                              starts, 
+                                                                              ends, 
+                                                                              strands, 
+                                                                              ["full_track", "PausingIndex"], 
+                                                                              min_len_after_padding=50, 
+                                                                              method_resolving_invalid_padding="drop", 
+                                                                              )
+
+        # The short region is dropped and filled with NaN
+        self.assertEqual(full_track.dtype, np.float64)
+        self.assertEqual(full_track.shape, (3, 1001))
+        self.assertTrue(np.isnan(full_track[1]).all())
+        self.assertTrue(np.array_equal(full_track[0], full_track[2]))
+        self.assertEqual(pausing_index.shape, (3, ))
+        self.assertTrue(np.isnan(pausing_index[1]))
+
+    def test_get_locality_order(self):
+        chroms = np.array(["chr2", "chr1", "chr2", "chr1"])
+        starts = np.array([100, 300, 50, 200])
+
+        order = BwSignalCounter.get_locality_order(chroms, starts)
+
+        self.assertEqual(list(order), [3, 1, 2, 0])
+
+    def test_get_approximate_error_bounds(self):
+        error_bounds = BwSignalCounter.get_approximate_error_bounds(np.array([1024, 64, 256]), 
+                                                                    np.array([100, 1000, 10000]), 
+                                                                    )
+
+        self.assertTrue(np.allclose(error_bounds, [0, 2 * 64 / 1000, 2 * 1024 / 10000]))
+
+    def test_get_region_zoom_level_inds(self):
+        zoom_level_inds = BwSignalCounter.get_region_zoom_level_inds(np.array([1024, 64, 256]), 
+                                                                     np.array([100, 1000, 10000]), 
+                                                                     )
+
+        self.assertEqual(list(zoom_level_inds), [-1, 1, 0])
+
+    def test_clip_region_coords(self):
+        clipped_starts, clipped_ends = BwSignalCounter.clip_region_coords({"chr1": 1000}, 
+                                                                          np.array(["chr1", "chr1", "chr2"]), 
+                                                                          np.array([-10, 900, 900]), 
+                                                                          np.array([100, 1100, 1100]), 
+                                                                          )
+
+        self.assertEqual(list(clipped_starts), [0, 900, 900])
+        self.assertEqual(list(clipped_ends), [100, 1000, 1100])
+
+    def test_count_bw_regions_approximate(self):
+        # Wide regions, a region at the chromosome start and 
+        # a region past the end of chr6 (170805979 bp)
+        chroms = np.array(["chr6", "chr14", "chr17", "chr17", "chr6"])
+        starts = np.array([170353801, 75078325, 45694026, 0, 170553801])
+        ends = np.array([170754802, 75479326, 46095027, 500000, 171553801])
+        strands = np.array(["+", "-", "+", "+", "-"])
+
+        exact_counts = BwSignalCounter.count_bw_regions(self.__bw_pls[0], 
+                                                        self.__bw_mns[0], 
+                                                        False, 
+                                                        chroms, 
+                                                        starts, 
+                                                        ends, 
+                                                        strands, 
+                                                        )
+        approximate_counts = BwSignalCounter.count_bw_regions(self.__bw_pls[0], 
+                                                              self.__bw_mns[0], 
+                                                              False, 
+                                                              chroms, 
+                                                              starts, 
+                                                              ends, 
+                                                              strands, 
+                                                              approximate=True, 
+                                                              )
+        error_bounds = BwSignalCounter.report_approximate_error_bounds(self.__bw_pls + self.__bw_mns, 
+                                                                       chroms, 
+                                                                       starts, 
+                                                                       ends, 
+                                                                       )
+
+        self.assertTrue((error_bounds <= 0.25).all())
+        for i in range(len(chroms)):
+            self.assertLessEqual(abs(approximate_counts[i] - exact_counts[i]), 
+                                 (error_bounds[i] + 1e-6) * exact_counts[i], 
+                                 )
+
+    def test_get_unique_region_inds(self):
+        chroms = np.array(["chr1", "chr2", "chr1", "chr1"])
+        starts = np.array([100, 100, 100, 100])
+        ends = np.array([200, 200, 200, 200])
+        strands = np.array(["+", "+", "+", "-"])
+
+        unique_inds, inverse_inds = BwSignalCounter.get_unique_region_inds(chroms, starts, ends, strands)
+
+        self.assertEqual(list(unique_inds), [0, 1, 3])
+        self.assertEqual(list(unique_inds[inverse_inds]), [0, 1, 0, 3])
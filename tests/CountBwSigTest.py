@@ -6,11 +6,14 @@ import sys
 import os
 
 import pandas as pd
+import numpy as np
 
 from scripts.RGTools.BedTable import BedTable3, BedTable6, BedTable6Plus
 
 sys.path.append("scripts")
 from scripts.count_bw_sig import CountBwSig
+from scripts.bw_signal_counter import BwSignalCounter
+from scripts.count_table_tool import CountTableTool
 
 class CountBwSigTest(unittest.TestCase):
     def setUp(self) -> None:
@@ -101,6 +104,15 @@ class CountBwSigTest(unittest.TestCase):
                                   method_resolving_invalid_padding="raise", 
                                   output_type="raw_count",
                                   region_id_type="chrom_start_end", 
+                                  processes=1, 
+                                  dtype="float64", 
+                                  output_format="csv", 
+                                  cache_dir=None, 
+                                  cache_max_size=20, 
+                                  chunk_size=None, 
+                                  checkpoint_dir=None, 
+                                  resume=False, 
+                                  approximate=False, 
                                   )
 
     def test_main_bed3_input(self):
@@ -288,6 +300,237 @@ class CountBwSigTest(unittest.TestCase):
 
         self.assertTrue(count_df.loc["chr6_170553801_170554802", "sample1"] - 680.64 < 0.01)
     
+    def test_processes(self):
+        job_name = "test_processes"
+        args = self.get_simple_args(job_name)
+        args.region_file_path = self.__bed6_path
+        args.sample_names = ["sample1", "sample2"]
+        args.bw_pls = self.__bw_pls * 2
+        args.bw_mns = self.__bw_mns * 2
+        args.processes = 2
+
+        CountBwSig.main(args)
+
+        count_df = pd.read_csv(os.path.join(self.__temp_dir, job_name + ".count.csv"), 
+                               index_col=0,
+                               )
+
+        self.assertEqual(count_df.shape, (3, 2))
+        self.assertEqual(list(count_df.columns), ["sample1", "sample2"])
+        self.assertEqual(count_df.loc["chr6_170553801_170554802", "sample1"], 348)
+        self.assertEqual(count_df.loc["chr6_170553801_170554802", "sample2"], 348)
+
+    def test_dtype(self):
+        job_name = "test_dtype"
+        args = self.get_simple_args(job_name)
+        args.region_file_path = self.__bed6_path
+        args.dtype = "float32"
+
+        CountBwSig.main(args)
+
+        count_df = pd.read_csv(os.path.join(self.__temp_dir, job_name + ".count.csv"), 
+                               index_col=0,
+                               )
+
+        self.assertEqual(count_df.loc["chr6_170553801_170554802", "sample1"], 348)
+
+        args.dtype = "int8"
+        with self.assertRaises(Exception):
+            CountBwSig.main(args)
+
+    def test_output_format(self):
+        job_name = "test_output_format"
+        args = self.get_simple_args(job_name)
+        args.region_file_path = self.__bed6gene_path
+        args.region_file_type = "bed6gene"
+
+        CountBwSig.main(args)
+
+        csv_count_df = CountTableTool.read_input_df(os.path.join(self.__temp_dir, job_name + ".count.csv"))
+        csv_region_info_df = CountTableTool.read_region_info_df(os.path.join(self.__temp_dir, job_name + ".region_info.csv"))
+
+        args.output_format = "npz"
+        CountBwSig.main(args)
+
+        npz_count_df = CountTableTool.read_input_df(os.path.join(self.__temp_dir, job_name + ".count.npz"))
+        npz_region_info_df = CountTableTool.read_region_info_df(os.path.join(self.__temp_dir, job_name + ".region_info.npz"))
+
+        self.assertTrue((npz_count_df.index == csv_count_df.index).all())
+        self.assertTrue((npz_count_df.columns == csv_count_df.columns).all())
+        self.assertTrue(np.array_equal(npz_count_df.values, csv_count_df.values))
+
+        self.assertEqual(npz_region_info_df.shape, (3, 7))
+        self.assertEqual(npz_region_info_df.loc["chr6_170553801_170554802", "gene_symbol"], "gene1")
+        self.assertEqual(npz_region_info_df.loc["chr6_170553801_170554802", "start"], 
+                         csv_region_info_df.loc["chr6_170553801_170554802", "start"])
+
+    def test_signal_cache(self):
+        job_name = "test_signal_cache"
+        args = self.get_simple_args(job_name)
+        args.region_file_path = self.__bed6_path
+        args.cache_dir = os.path.join(self.__temp_dir, "signal_cache")
+
+        # The first run builds the cache and the second run reads it
+        for _ in range(2):
+            CountBwSig.main(args)
+
+            count_df = pd.read_csv(os.path.join(self.__temp_dir, job_name + ".count.csv"), 
+                                   index_col=0,
+                                   )
+            self.assertEqual(count_df.loc["chr6_170553801_170554802", "sample1"], 348)
+
+        self.assertEqual(len(os.listdir(args.cache_dir)), 2)
+
+        BwSignalCounter.evict_signal_cache(args.cache_dir, 0)
+        self.assertEqual(len(os.listdir(args.cache_dir)), 0)
+
+        # A full cache is evicted once counting is done, with several processes
+        args.cache_max_size = 0
+        args.sample_names = ["sample1", "sample2"]
+        args.bw_pls = self.__bw_pls * 2
+        args.bw_mns = self.__bw_mns * 2
+        args.processes = 2
+        CountBwSig.main(args)
+
+        count_df = pd.read_csv(os.path.join(self.__temp_dir, job_name + ".count.csv"), 
+                               index_col=0,
+                               )
+        self.assertEqual(count_df.loc["chr6_170553801_170554802", "sample2"], 348)
+        self.assertEqual(len(os.listdir(args.cache_dir)), 0)
+
+        # Writing to an evicted bigwig cache does not recreate it
+        bw_cache_dir = os.path.join(args.cache_dir, "evicted")
+        chrom_cumsum = (np.array([0]), np.array([10]), np.array([1.]), np.array([0., 10.]))
+        BwSignalCounter.write_cached_signal_cumsum(bw_cache_dir, "chr1", chrom_cumsum)
+        self.assertFalse(os.path.exists(bw_cache_dir))
+
+    def test_chunk_size(self):
+        job_name = "test_chunk_size"
+        args = self.get_simple_args(job_name)
+        args.region_file_path = self.__bed6_path
+        args.chunk_size = 2
+
+        CountBwSig.main(args)
+
+        count_df = pd.read_csv(os.path.join(self.__temp_dir, job_name + ".count.csv"), 
+                               index_col=0,
+                               )
+        region_info_df = pd.read_csv(os.path.join(self.__temp_dir, job_name + ".region_info.csv"), 
+                                     index_col=0,
+                                     )
+
+        args.job_name = job_name + "_whole_file"
+        args.chunk_size = None
+        CountBwSig.main(args)
+
+        whole_file_count_df = pd.read_csv(os.path.join(self.__temp_dir, args.job_name + ".count.csv"), 
+                                          index_col=0,
+                                          )
+        whole_file_region_info_df = pd.read_csv(os.path.join(self.__temp_dir, args.job_name + ".region_info.csv"), 
+                                                index_col=0,
+                                                )
+
+        self.assertEqual(count_df.shape, (3, 1))
+        self.assertEqual(region_info_df.shape, (3, 6))
+        self.assertEqual(count_df.loc["chr6_170553801_170554802", "sample1"], 348)
+        pd.testing.assert_frame_equal(count_df, whole_file_count_df)
+        pd.testing.assert_frame_equal(region_info_df, whole_file_region_info_df)
+
+        args.chunk_size = 2
+        args.output_format = "npz"
+        with self.assertRaises(Exception):
+            CountBwSig.main(args)
+
+        # Unsorted region files are rejected, the first chunk is 
+        # sorted and the second is not
+        unsorted_bed6_path = os.path.join(self.__temp_dir, "unsorted.bed6")
+        region_info_df[["chrom", "start", "end", "name", "score", "strand"]].iloc[[0, 2, 1]].to_csv(unsorted_bed6_path, 
+                                                                                                  sep="\t", 
+                                                                                                  header=False, 
+                                                                                                  index=False, 
+                                                                                                  )
+        args.region_file_path = unsorted_bed6_path
+        args.job_name = job_name + "_unsorted"
+        args.output_format = "csv"
+        with self.assertRaises(Exception):
+            CountBwSig.main(args)
+
+        # No partial output is left behind
+        self.assertEqual([f for f in os.listdir(self.__temp_dir) if args.job_name in f], [])
+
+    def test_checkpoint_resume(self):
+        job_name = "test_checkpoint_resume"
+        args = self.get_simple_args(job_name)
+        args.region_file_path = self.__bed6_path
+        args.checkpoint_dir = os.path.join(self.__temp_dir, "checkpoint")
+
+        CountBwSig.main(args)
+
+        self.assertTrue(os.path.exists(os.path.join(args.checkpoint_dir, "sample1.npy")))
+
+        # Resumed runs read the checkpoint instead of the bigwig
+        counts = np.load(os.path.join(args.checkpoint_dir, "sample1.npy"))
+        np.save(os.path.join(args.checkpoint_dir, "sample1.npy"), counts + 1)
+
+        args.resume = True
+        CountBwSig.main(args)
+
+        count_df = pd.read_csv(os.path.join(self.__temp_dir, job_name + ".count.csv"), 
+                               index_col=0,
+                               )
+        self.assertEqual(count_df.loc["chr6_170553801_170554802", "sample1"], 349)
+
+        # Changed counting options invalidate the checkpoint
+        args.l_pad = -100
+        args.r_pad = -100
+        CountBwSig.main(args)
+
+        count_df = pd.read_csv(os.path.join(self.__temp_dir, job_name + ".count.csv"), 
+                               index_col=0,
+                               )
+        self.assertEqual(count_df.loc["chr6_170553801_170554802", "sample1"], 344)
+
+    def test_multiple_output_types(self):
+        job_name = "test_multiple_output_types"
+        args = self.get_simple_args(job_name)
+        args.region_file_path = self.__bed6_path
+        args.output_type = "raw_count,RPK"
+
+        CountBwSig.main(args)
+
+        count_df = pd.read_csv(os.path.join(self.__temp_dir, job_name + ".count.csv"), 
+                               index_col=0,
+                               )
+        rpk_df = pd.read_csv(os.path.join(self.__temp_dir, job_name + ".RPK.csv"), 
+                             index_col=0,
+                             )
+
+        self.assertEqual(count_df.loc["chr6_170553801_170554802", "sample1"], 348)
+        self.assertAlmostEqual(rpk_df.loc["chr6_170553801_170554802", "sample1"], 348 / 1001 * 1e3)
+
+    def test_library_size_normalization(self):
+        job_name = "test_library_size_normalization"
+        args = self.get_simple_args(job_name)
+        args.region_file_path = self.__bed6_path
+        args.output_type = "raw_count,CPM,RPKM"
+
+        CountBwSig.main(args)
+
+        library_size = BwSignalCounter.get_bw_library_size(self.__bw_pls[0], self.__bw_mns[0], False)
+        self.assertTrue(library_size > 0)
+
+        cpm_df = pd.read_csv(os.path.join(self.__temp_dir, job_name + ".CPM.csv"), 
+                             index_col=0,
+                             )
+        rpkm_df = pd.read_csv(os.path.join(self.__temp_dir, job_name + ".RPKM.csv"), 
+                              index_col=0,
+                              )
+
+        self.assertAlmostEqual(cpm_df.loc["chr6_170553801_170554802", "sample1"], 
+                               348 / library_size * 1e6)
+        self.assertAlmostEqual(rpkm_df.loc["chr6_170553801_170554802", "sample1"], 
+                               348 / 1001 * 1e3 / library_size * 1e6)
+
     def test_region_id_handling(self):
         job_name = "test_region_id_handling"
 
@@ -307,3 +550,28 @@ class CountBwSigTest(unittest.TestCase):
         self.assertEqual(count_df.shape, (3, 1))
 
         self.assertEqual(count_df.index[0], "FOS")
+
+    def test_get_region_ids(self):
+        region_df = pd.DataFrame({"chrom": ["chr1", "chr2"], 
+                                  "start": [100, 200], 
+                                  "end": [150, 260], 
+                                  "name": ["A", "B"], 
+                                  })
+
+        self.assertEqual(list(CountBwSig.get_region_ids(region_df, "chrom_start_end")), 
+                         ["chr1_100_150", "chr2_200_260"])
+        self.assertEqual(list(CountBwSig.get_region_ids(region_df, "name")), 
+                         ["A", "B"])
+        self.assertEqual(list(CountBwSig.get_region_ids(region_df, "chrom_start_end_name")), 
+                         ["chr1_100_150_A", "chr2_200_260_B"])
+
+        with self.assertRaises(Exception):
+            CountBwSig.get_region_ids(region_df, "unknown")
+
+    def test_approximate_output_type_check(self):
+        args = self.get_simple_args("test_approximate_output_type_check")
+        args.output_type = "raw_count,PausingIndex"
+        args.approximate = True
+
+        with self.assertRaises(Exception):
+            CountBwSig.main(args)
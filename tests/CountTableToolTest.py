@@ -142,3 +142,31 @@ class CountTableToolTest(unittest.TestCase):
                                               ))
 
         self.assertEqual(output_bt.get_start_locs()[1], 19)
+
+    def test_load_npz_arrays(self):
+        npz_path = os.path.join(self.__test_dir, "table.npz")
+        values = np.arange(6, dtype=np.float32).reshape(3, 2)
+        np.savez(npz_path, 
+                 index=np.array(["r1", "r2", "r3"]), 
+                 columns=np.array(["s1", "s2"]), 
+                 values=values, 
+                 )
+
+        npz_dict = CountTableTool.load_npz_arrays(npz_path)
+        self.assertIsInstance(npz_dict["values"], np.memmap)
+        self.assertTrue(np.array_equal(npz_dict["values"], values))
+
+        input_df = CountTableTool.read_input_df(npz_path)
+        self.assertEqual(list(input_df.index), ["r1", "r2", "r3"])
+        self.assertTrue(np.array_equal(input_df.values, values))
+
+        # Compressed npz files are read into memory
+        np.savez_compressed(npz_path, 
+                            index=np.array(["r1", "r2", "r3"]), 
+                            columns=np.array(["s1", "s2"]), 
+                            values=values, 
+                            )
+
+        npz_dict = CountTableTool.load_npz_arrays(npz_path)
+        self.assertNotIsInstance(npz_dict["values"], np.memmap)
+        self.assertTrue(np.array_equal(npz_dict["values"], values))
@@ -7,6 +7,7 @@ import sys
 import os
 
 import numpy as np
+import pandas as pd
 
 from Bio import SeqIO
 
@@ -39,6 +40,10 @@ class ExogeneousToolTest(unittest.TestCase):
                                   fasta_out=os.path.join(self.__test_dir, "test_output.fasta"),
                                   region_out=os.path.join(self.__test_dir, "test_output.bed"),
                                   regex="chr2_127105185_127107299.*", 
+                                  pl_track_npy=None, 
+                                  mn_track_npy=None, 
+                                  pl_track_out=None, 
+                                  mn_track_out=None, 
                                   subcommand="filter",
                                   )
         return args
@@ -61,6 +66,38 @@ class ExogeneousToolTest(unittest.TestCase):
                 self.assertEqual(record.id[:24], "chr2_127105185_127107299")
                 self.assertEqual(record.seq[:5], "CAAAG")
 
+    def test_filter_main_region_and_tracks(self):
+        args = self.get_parse_default_args()
+        args.pl_track_npy = self.__sample_pl_track_npy_path
+        args.mn_track_npy = self.__sample_mn_track_npy_path
+        args.pl_track_out = os.path.join(self.__test_dir, "test_output.pl.npy")
+        args.mn_track_out = os.path.join(self.__test_dir, "test_output.mn.npy")
+
+        ExogeneousTool.filter_main(args)
+
+        with open(args.fasta_out, "r") as output_f:
+            output_seq_ids = [record.id for record in SeqIO.parse(output_f, "fasta")]
+
+        output_region_df = pd.read_csv(args.region_out, sep="\t", header=None)
+        self.assertTrue(len(output_region_df) > 0)
+        self.assertTrue(output_region_df[0].str.startswith("chr2_127105185_127107299").all())
+
+        input_region_df = pd.read_csv(args.region_file_path, sep="\t", header=None)
+        keep_logical = input_region_df[0].str.match(args.regex).values
+
+        for track_npy, track_out in [(args.pl_track_npy, args.pl_track_out), 
+                                     (args.mn_track_npy, args.mn_track_out), 
+                                     ]:
+            output_track = np.load(track_out)
+            self.assertEqual(output_track.shape[0], len(output_region_df))
+            self.assertTrue((output_track == np.load(track_npy)[keep_logical]).all())
+
+        # The output is overwritten, not appended to
+        ExogeneousTool.filter_main(args)
+
+        with open(args.fasta_out, "r") as output_f:
+            self.assertEqual([record.id for record in SeqIO.parse(output_f, "fasta")], output_seq_ids)
+
     def get_compare_mutagenesis_default_args(self):
         args = argparse.Namespace(fasta=self.__sample_exogeneous_fasta_path,
                                   region_file_path=self.__sample_bed3_path,
@@ -99,6 +136,69 @@ class ExogeneousToolTest(unittest.TestCase):
                               ], 
                              )
 
+    def test_compare_mutagenesis_main_multiple_mutants(self):
+        # Regions are in sorted order, seqC has no mutated sequence
+        seq_names = ["seqA_1:A2C", "seqA_2:C2G", "seqA_3:G2T", "seqA_ref", 
+                     "seqB_1:A2C", "seqB_2:T2A", "seqB_ref", "seqC_ref"]
+
+        args = self.get_compare_mutagenesis_default_args()
+        args.fasta = os.path.join(self.__test_dir, "mutagenesis.fa")
+        args.region_file_path = os.path.join(self.__test_dir, "mutagenesis.bed3")
+        args.pl_track_npy = os.path.join(self.__test_dir, "mutagenesis_pl.npy")
+        args.mn_track_npy = os.path.join(self.__test_dir, "mutagenesis_mn.npy")
+        args.jsd_distribution_plot_path = None
+        args.total_count_plot_path = None
+
+        with open(args.fasta, "w") as fasta_f:
+            fasta_f.write("".join(">{}\nACGTA\n".format(seq_name) for seq_name in seq_names))
+        with open(args.region_file_path, "w") as region_f:
+            region_f.write("".join("{}\t0\t5\n".format(seq_name) for seq_name in seq_names))
+
+        np.save(args.pl_track_npy, (np.arange(40).reshape(8, 5) % 7 + 1).astype(np.float32))
+        np.save(args.mn_track_npy, -(np.arange(40)[::-1].reshape(8, 5) % 6 + 1).astype(np.float32))
+
+        ExogeneousTool.compare_mutagenesis_main(args)
+
+        # Output of the per-reference implementation
+        expected_dict = {
+            "seqA": {"ref_log_total_count": 1.591064691543579, 
+                     "mut_log_total_count": [1.4913617372512817, 1.531479001045227, 1.633468508720398], 
+                     "diff_log_total_count": [0.09970295429229736, 0.05958569049835205, 0.04240381717681885], 
+                     "pl_ref_mut_jsd": [0.04996449872851372, 0.3200901746749878, 0.2555660009384155], 
+                     "mn_ref_mut_jsd": [0.31584474444389343, 0.27203649282455444, 0.24045218527317047], 
+                     "combined_ref_mut_jsd": [0.22713784873485565, 0.3007122576236725, 0.24948440492153168], 
+                     }, 
+            "seqB": {"ref_log_total_count": 1.6127839088439941, 
+                     "mut_log_total_count": [1.5440680980682373, 1.5797836780548096], 
+                     "diff_log_total_count": [0.06871581077575684, 0.03300023078918457], 
+                     "pl_ref_mut_jsd": [0.25154176354408264, 0.29366156458854675], 
+                     "mn_ref_mut_jsd": [0.32225722074508667, 0.2679118514060974], 
+                     "combined_ref_mut_jsd": [0.2968592345714569, 0.28455299139022827], 
+                     }, 
+        }
+
+        for seq_id, expected_track_info_dict in expected_dict.items():
+            with open(os.path.join(args.opath, seq_id + ".json"), "r") as output_f:
+                self.assertEqual(json.load(output_f), expected_track_info_dict)
+
+        self.assertFalse(os.path.exists(os.path.join(args.opath, "seqC.json")))
+
+    def test_group_ref_mut_regions(self):
+        seq_ids = np.array(["b", "a", "b", "c", "a", "a", "b", "a"])
+        seq_types = np.array(["mut", "ref", "ref", "ref", "mut", "mut", "mut", "other"])
+
+        group_seq_ids, ref_inds, mut_inds, mut_group_boundaries = ExogeneousTool.group_ref_mut_regions(seq_ids, seq_types)
+
+        # c has no mutated sequence and is skipped, 
+        # regions that are neither ref nor mut are not paired
+        self.assertEqual(group_seq_ids.tolist(), ["a", "b"])
+        self.assertEqual(ref_inds.tolist(), [1, 2])
+        self.assertEqual(mut_inds.tolist(), [4, 5, 0, 6])
+        self.assertEqual(mut_group_boundaries.tolist(), [0, 2, 4])
+
+        with self.assertRaises(ValueError):
+            ExogeneousTool.group_ref_mut_regions(np.array(["a", "a"]), np.array(["mut", "mut"]))
+
     def set_up_compute_track_correlation_test(self):
         self.__pseudosample_pl_track_npy_path = os.path.join(self.__test_dir, "pseudosample_pl_track.npy")
         self.__pseudosample_mn_track_npy_path = os.path.join(self.__test_dir, "pseudosample_mn_track.npy")
@@ -96,7 +96,13 @@ class GenomicElementToolTest(unittest.TestCase):
         args.region_file_type = "bed6"
         args.override_strand = None
         args.quantification_type = "raw_count"
+        args.min_len_after_padding = 50
+        args.method_resolving_invalid_padding = "raise"
         args.opath = os.path.join(self.__temp_dir, "output.npy")
+        args.cache_dir = None
+        args.cache_max_size = 20
+        args.approximate = False
+        args.processes = 1
 
         return args
 
@@ -118,6 +124,284 @@ class GenomicElementToolTest(unittest.TestCase):
 
         self.assertEqual(output.shape, (3, 1001))
 
+        args.quantification_type = "unknown"
+        with self.assertRaises(ValueError):
+            GenomicElementTool.count_bw_main(args)
+
+    def test_count_bw_invalid_padding(self):
+        args = self.get_count_bw_simple_args()
+        args.min_len_after_padding = 2000
+
+        # Batch and BwTrack quantification types follow the same policy
+        for quantification_type in ["raw_count", "PausingIndex"]:
+            args.quantification_type = quantification_type
+            args.method_resolving_invalid_padding = "raise"
+            with self.assertRaises(Exception):
+                GenomicElementTool.count_bw_main(args)
+
+            args.method_resolving_invalid_padding = "drop"
+            GenomicElementTool.count_bw_main(args)
+
+            output = np.load(args.opath)
+
+            self.assertEqual(output.shape, (3,))
+            self.assertTrue(np.isnan(output).all())
+
+    def test_count_bw_signal_cache(self):
+        args = self.get_count_bw_simple_args()
+        args.cache_dir = os.path.join(self.__temp_dir, "signal_cache")
+
+        for _ in range(2):
+            GenomicElementTool.count_bw_main(args)
+
+            output = np.load(args.opath)
+
+            self.assertEqual(output[0], 17)
+            self.assertEqual(output[2], 348)
+
+    def test_count_bw_approximate(self):
+        args = self.get_count_bw_simple_args()
+        args.approximate = True
+
+        GenomicElementTool.count_bw_main(args)
+
+        output = np.load(args.opath)
+
+        self.assertEqual(output.shape, (3,))
+        self.assertTrue(output[2] > 0)
+
+        args.quantification_type = "full_track"
+        with self.assertRaises(ValueError):
+            GenomicElementTool.count_bw_main(args)
+
+    def test_count_bw_multiple_tracks(self):
+        args = self.get_count_bw_simple_args()
+        args.bw_pl = [self.__bw_pls[0]] * 2
+        args.bw_mn = [self.__bw_mns[0]] * 2
+
+        for processes in [1, 2]:
+            args.processes = processes
+            GenomicElementTool.count_bw_main(args)
+
+            output = np.load(args.opath)
+
+            self.assertEqual(output.shape, (3, 2))
+            self.assertEqual(list(output[0]), [17, 17])
+            self.assertEqual(list(output[2]), [348, 348])
+
+    def get_profile_simple_args(self):
+        args = argparse.Namespace()
+        args.subcommand = "profile"
+        args.bw_pls = self.__bw_pls
+        args.bw_mns = self.__bw_mns
+        args.single_bw = False
+        args.region_file_path = self.__bed6_path
+        args.region_file_type = "bed6"
+        args.override_strand = None
+        args.bin_size = 1001
+        args.chunk_size = 10000
+        args.opath = os.path.join(self.__temp_dir, "profile.npy")
+
+        return args
+
+    def test_profile(self):
+        args = self.get_profile_simple_args()
+
+        GenomicElementTool.profile_main(args)
+
+        output = np.load(args.opath)
+
+        self.assertEqual(output.shape, (3, 1, 1))
+        self.assertEqual(output[0, 0, 0], 17)
+        self.assertEqual(output[2, 0, 0], 348)
+
+        args.bin_size = 7
+        GenomicElementTool.profile_main(args)
+
+        output = np.load(args.opath)
+
+        self.assertEqual(output.shape, (3, 1, 143))
+        self.assertEqual(output[0, 0].sum(), 17)
+        self.assertEqual(output[2, 0].sum(), 348)
+
+        args.bin_size = 10
+        with self.assertRaises(ValueError):
+            GenomicElementTool.profile_main(args)
+
+    def get_extract_track_simple_args(self):
+        args = argparse.Namespace()
+        args.subcommand = "extract_track"
+        args.bw_pl = self.__bw_pls[0]
+        args.bw_mn = self.__bw_mns[0]
+        args.single_bw = False
+        args.region_file_path = self.__bed6_path
+        args.region_file_type = "bed6"
+        args.override_strand = None
+        args.opath_pl = os.path.join(self.__temp_dir, "track.pl.npy")
+        args.opath_mn = os.path.join(self.__temp_dir, "track.mn.npy")
+        args.dtype = "float64"
+        args.chunk_size = 10000
+        args.processes = 1
+
+        return args
+
+    def test_extract_track(self):
+        args = self.get_extract_track_simple_args()
+
+        for processes in [1, 2]:
+            args.processes = processes
+            GenomicElementTool.extract_track_main(args)
+
+            pl_output = np.load(args.opath_pl)
+            mn_output = np.load(args.opath_mn)
+
+            self.assertEqual(pl_output.shape, (3, 1001))
+            self.assertEqual(mn_output.shape, (3, 1001))
+            self.assertTrue((mn_output <= 0).all())
+
+            # Tracks are flipped to the strand of the element
+            self.assertEqual(pl_output[0].sum(), 17)
+            self.assertEqual(pl_output[2].sum(), 348)
+
+    def test_fill_bw_profile_memory_budget(self):
+        chroms = np.array(["chr6"] * 3)
+        starts = np.array([170553801, 170553801, 170554301])
+        reverse_logical = np.array([False, True, False])
+
+        output_list = []
+        for max_chunk_bytes in [256 * 1024 ** 2, 1]:
+            output_arr = np.zeros((3, 500))
+            GenomicElementTool.fill_bw_profile(self.__bw_pls[0], 
+                                               chroms, 
+                                               starts, 
+                                               np.arange(3), 
+                                               1, 
+                                               500, 
+                                               reverse_logical, 
+                                               output_arr, 
+                                               max_chunk_bytes=max_chunk_bytes, 
+                                               )
+            output_list.append(output_arr)
+
+        # One region at a time gives the same tracks
+        self.assertTrue(np.array_equal(output_list[0], output_list[1]))
+        self.assertTrue(np.array_equal(output_list[0][1], output_list[0][0][::-1]))
+
+    def get_onehot_simple_args(self):
+        fasta_path = os.path.join(self.__temp_dir, "onehot.fa")
+        with open(fasta_path, "w") as fasta_f:
+            fasta_f.write(">chr1\nACGTNacgt\n>chr2\nTTTTGGGG\n")
+
+        region_path = os.path.join(self.__temp_dir, "onehot.bed3")
+        pd.DataFrame({"chrom": ["chr1", "chr2", "chr1"], 
+                      "start": [0, 6, 5], 
+                      "end": [4, 10, 9], 
+                      }).to_csv(region_path, sep="\t", header=False, index=False)
+
+        args = argparse.Namespace()
+        args.subcommand = "onehot"
+        args.fasta_path = fasta_path
+        args.region_file_path = region_path
+        args.region_file_type = "bed3"
+        args.opath = os.path.join(self.__temp_dir, "onehot.npy")
+        args.chunk_size = 10000
+        args.workers = 1
+        args.tmp_dir = None
+        args.packbits = False
+        args.output_format = "dense"
+        args.offsets_opath = None
+
+        return args
+
+    def test_onehot(self):
+        args = self.get_onehot_simple_args()
+
+        GenomicElementTool.onehot_main(args)
+
+        output = np.load(args.opath)
+
+        self.assertEqual(output.dtype, np.uint8)
+        self.assertEqual(output.shape, (3, 4, 4))
+        self.assertEqual(output.sum(), 10)
+        self.assertEqual(output[0].argmax(axis=1).tolist(), [0, 1, 2, 3])
+
+        args.packbits = True
+        GenomicElementTool.onehot_main(args)
+
+        packed_output = np.load(args.opath)
+
+        self.assertEqual(packed_output.shape, (3, 2))
+        self.assertTrue((np.unpackbits(packed_output, axis=1, count=16).reshape(3, 4, 4) == output).all())
+
+    def test_onehot_workers(self):
+        args = self.get_onehot_simple_args()
+
+        GenomicElementTool.onehot_main(args)
+        with open(args.opath, "rb") as output_f:
+            single_process_output = output_f.read()
+
+        args.workers = 2
+        args.chunk_size = 1
+        args.tmp_dir = os.path.join(self.__temp_dir, "onehot_tmp")
+        os.makedirs(args.tmp_dir)
+        GenomicElementTool.onehot_main(args)
+        with open(args.opath, "rb") as output_f:
+            self.assertEqual(output_f.read(), single_process_output)
+
+        # Temporary base codes are removed
+        self.assertEqual(os.listdir(args.tmp_dir), [])
+
+    def test_onehot_ragged(self):
+        args = self.get_onehot_simple_args()
+        args.output_format = "ragged"
+        args.offsets_opath = os.path.join(self.__temp_dir, "onehot.offsets.npy")
+
+        # Elements of different sizes
+        pd.DataFrame({"chrom": ["chr1", "chr2"], 
+                      "start": [0, 2], 
+                      "end": [5, 4], 
+                      }).to_csv(args.region_file_path, sep="\t", header=False, index=False)
+
+        GenomicElementTool.onehot_main(args)
+
+        codes = np.load(args.opath)
+        offsets = np.load(args.offsets_opath)
+
+        self.assertEqual(offsets.tolist(), [0, 5, 7])
+        self.assertEqual(codes.tolist(), [0, 1, 2, 3, 4, 3, 3])
+
+    def test_onehot_parity(self):
+        args = self.get_onehot_simple_args()
+        with open(args.fasta_path, "w") as fasta_f:
+            fasta_f.write(">chr1\nACGTNRACGG\n>chr2\nTTAGCCNNAT\n")
+
+        args.region_file_type = "bed6"
+        args.region_file_path = os.path.join(self.__temp_dir, "onehot.bed6")
+        pd.DataFrame({"chrom": ["chr1", "chr2", "chr1", "chr2"], 
+                      "start": [0, 1, 4, 5], 
+                      "end": [5, 6, 9, 10], 
+                      "name": ["e1", "e2", "e3", "e4"], 
+                      "score": [0, 0, 0, 0], 
+                      "strand": ["+", "-", "-", "+"], 
+                      }).to_csv(args.region_file_path, sep="\t", header=False, index=False)
+
+        GenomicElementTool.onehot_main(args)
+        output = np.load(args.opath)
+
+        genomic_elements = GenomicElements(region_path=args.region_file_path, 
+                                           region_file_type=args.region_file_type, 
+                                           fasta_path=args.fasta_path, 
+                                           )
+        self.assertTrue(np.array_equal(output, genomic_elements.get_all_region_one_hot()))
+
+        # The ragged codes decode to the same one-hot encoding
+        args.output_format = "ragged"
+        args.offsets_opath = os.path.join(self.__temp_dir, "onehot.offsets.npy")
+        GenomicElementTool.onehot_main(args)
+
+        codes = np.load(args.opath)
+        self.assertTrue(np.array_equal(GenomicElementTool.encode_region_codes(codes.reshape(4, 5)), output))
+
     def get_pad_region_simple_args(self):
         args = argparse.Namespace()
         args.subcommand = "pad_region"
@@ -168,6 +452,31 @@ class GenomicElementToolTest(unittest.TestCase):
         output_bt.load_from_file(args.opath)
         self.assertEqual(len(output_bt), 0)
 
+    def test_get_padded_region_coords(self):
+        starts = np.array([100, 100, 5])
+        ends = np.array([200, 200, 50])
+        strands = np.array(["+", "-", "+"])
+
+        padded_starts, padded_ends, valid_logical = GenomicElementTool.get_padded_region_coords(starts, ends, strands, 10, 20)
+
+        self.assertEqual(list(padded_starts), [90, 80, -5])
+        self.assertEqual(list(padded_ends), [220, 210, 70])
+        self.assertEqual(list(valid_logical), [True, True, False])
+
+        padded_starts, padded_ends, _ = GenomicElementTool.get_padded_region_coords(starts, ends, None, 10, 20)
+
+        self.assertEqual(list(padded_starts), [90, 90, -5])
+        self.assertEqual(list(padded_ends), [220, 220, 70])
+
+        # Unstranded regions are padded like plus strand regions
+        padded_starts, padded_ends, _ = GenomicElementTool.get_padded_region_coords(starts, ends, np.array([".", "-", "+"]), 10, 20)
+
+        self.assertEqual(list(padded_starts), [90, 80, -5])
+        self.assertEqual(list(padded_ends), [220, 210, 70])
+
+        with self.assertRaises(ValueError):
+            GenomicElementTool.get_padded_region_coords(starts, ends, np.array(["+", "*", "+"]), 10, 20)
+
     def get_bed2tssbed_simple_args(self):
         args = argparse.Namespace()
         args.subcommand = "bed2tssbed"
@@ -191,6 +500,34 @@ class GenomicElementToolTest(unittest.TestCase):
         self.assertEqual(output_bt.get_start_locs()[0], 75279325)
         self.assertEqual(output_bt.get_end_locs()[0], 75279326)
 
+    def test_bed2tssbed_both_strands(self):
+        args = self.get_bed2tssbed_simple_args()
+
+        GenomicElementTool.bed2tssbed_main(args)
+
+        output_bt = BedTable6()
+        output_bt.load_from_file(args.opath)
+
+        # Regions are sorted: FOS (-), MAPT (+), TBP (+)
+        self.assertEqual(list(output_bt.get_start_locs()), [75279325, 45894026, 170553801])
+        self.assertEqual(list(output_bt.get_end_locs()), [75279326, 45894027, 170553802])
+
+    def test_bed2tssbed_bed3_center(self):
+        args = self.get_bed2tssbed_simple_args()
+
+        args.region_file_type = "bed3"
+        args.region_file_path = self.__bed3_path
+        args.opath = os.path.join(self.__temp_dir, "bed2tssbed_output.bed3")
+        args.output_site = "center"
+
+        GenomicElementTool.bed2tssbed_main(args)
+
+        output_bt = BedTable3()
+        output_bt.load_from_file(args.opath)
+
+        self.assertEqual(list(output_bt.get_start_locs()), [75278825, 45894526, 170554301])
+        self.assertEqual(list(output_bt.get_end_locs()), [75278826, 45894527, 170554302])
+
     def test_bed2tssbed_bed6gene_io(self):
 
         args = self.get_bed2tssbed_simple_args()